@@ -8,7 +8,8 @@ from flask import redirect, url_for
 from flask_login import current_user
 from app.routes.quiz import quiz_bp
 from utils.image_processor import analyze_note_image
-from utils.lecture_processor import process_files, lecture_student
+from utils.lecture_processor import lecture_student
+from utils.ingest import extract_files
 
 
 app = Flask(__name__)
@@ -54,8 +55,8 @@ def start_class():
         file.save(path)
         saved_paths.append(path)
     
-    # 1. Extract content from all files
-    all_text = process_files(saved_paths)
+    # 1. Extract content from all files (in parallel, joined in upload order)
+    all_text, _ = extract_files(saved_paths)
     
     # 2. Get the AI Professor's lecture
     lecture_script = lecture_student(all_text)
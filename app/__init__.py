@@ -36,6 +36,7 @@ def create_app(config_class=Config):
     from app.routes.processor import processor_bp
     from app.routes.quiz import quiz_bp
     from app.routes.chatfroff import chatproff_bp
+    from app.routes.admin import admin_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(processor_bp)
@@ -43,6 +44,7 @@ def create_app(config_class=Config):
     app.register_blueprint(library_bp)
     app.register_blueprint(classroom_bp)
     app.register_blueprint(chatproff_bp)
+    app.register_blueprint(admin_bp)
 
     @app.route('/')
     def index():
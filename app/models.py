@@ -1,11 +1,17 @@
+import hashlib
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 from datetime import datetime
 
 
 db =  SQLAlchemy()
 
 
+def text_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
 class User(db.Model, UserMixin):
     __tablename__='users'
 
@@ -36,6 +42,8 @@ class Lecture(db.Model):
         timestamp = db.Column(db.DateTime, nullable=False)
 
         transcript = db.Column(db.Text)
+        # Digest of transcript, kept in step on every write so readers never rehash the text
+        transcript_hash = db.Column(db.String(64), nullable=True)
         summary = db.Column(db.Text, nullable=True)
 
         original_filename = db.Column(db.String(100))
@@ -43,6 +51,11 @@ class Lecture(db.Model):
 
         user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
+        @validates('transcript')
+        def _hash_transcript(self, key, transcript):
+            self.transcript_hash = text_hash(transcript)
+            return transcript
+
         def __repr__(self):
             return f'<Lecture {self.title}>'
         
@@ -78,8 +91,79 @@ class ClassSession(db.Model):
     
     current_module_index = db.Column(db.Integer, default=0)
     modules_json = db.Column(db.Text) 
+    knowledge_map = db.Column(db.Text)
+    # False while the class runs on a provisional syllabus that is still being planned
+    syllabus_ready = db.Column(db.Boolean, default=True)
+    # Set by the worker planning the syllabus, so only one worker refines a class at a time
+    refine_started_at = db.Column(db.DateTime, nullable=True)
     is_active = db.Column(db.Boolean, default=True)
 
     # Relationships
     lecture = db.relationship('Lecture', backref='class_sessions')
-    user = db.relationship('User', backref='class_sessions')
\ No newline at end of file
+    user = db.relationship('User', backref='class_sessions')
+
+
+class ChunkSummary(db.Model):
+    __tablename__ = 'chunk_summaries'
+    id = db.Column(db.Integer, primary_key=True)
+    lecture_id = db.Column(db.Integer, db.ForeignKey('lectures.id'), nullable=False, index=True)
+
+    # sha256 of the map prompt version + chunk text, so edits or prompt changes never match stale rows
+    chunk_hash = db.Column(db.String(64), nullable=False)
+    chunk_index = db.Column(db.Integer, nullable=False)
+    summary = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('lecture_id', 'chunk_hash', name='uq_chunk_summary_lecture_hash'),)
+
+    lecture = db.relationship('Lecture', backref=db.backref('chunk_summaries', cascade='all, delete-orphan'))
+
+
+class LectureIndex(db.Model):
+    __tablename__ = 'lecture_indexes'
+    id = db.Column(db.Integer, primary_key=True)
+    lecture_id = db.Column(db.Integer, db.ForeignKey('lectures.id'), nullable=False, unique=True)
+
+    # BM25 index as zlib-compressed JSON; chunks are offsets into the transcript, not copies of it
+    text_hash = db.Column(db.String(64), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    lecture = db.relationship('Lecture', backref=db.backref('search_index', uselist=False, cascade='all, delete-orphan'))
+
+
+class ModuleContent(db.Model):
+    __tablename__ = 'module_contents'
+    id = db.Column(db.Integer, primary_key=True)
+    lecture_id = db.Column(db.Integer, db.ForeignKey('lectures.id'), nullable=False, index=True)
+    module_index = db.Column(db.Integer, nullable=False)
+    prompt_version = db.Column(db.String(16), nullable=False)
+
+    # A regenerated syllabus can put a different module at the same index
+    module_title = db.Column(db.String(255), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('lecture_id', 'module_index', 'prompt_version', name='uq_module_content_lecture_index_version'),)
+
+    lecture = db.relationship('Lecture', backref=db.backref('module_contents', cascade='all, delete-orphan'))
+
+
+class ProfessorChat(db.Model):
+    __tablename__ = 'professor_chats'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    lecture_id = db.Column(db.Integer, db.ForeignKey('lectures.id'), nullable=True)
+
+    # Older turns are folded into summary; turns_json keeps the recent ones verbatim
+    summary = db.Column(db.Text)
+    turns_json = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Bumped on every write, so concurrent turns and compactions can't overwrite each other
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'lecture_id', name='uq_professor_chat_user_lecture'),)
+    __mapper_args__ = {'version_id_col': version}
+
+    user = db.relationship('User', backref='professor_chats')
+    lecture = db.relationship('Lecture', backref=db.backref('professor_chats', cascade='all, delete-orphan'))
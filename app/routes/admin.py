@@ -1,11 +1,24 @@
+from flask import Blueprint, render_template, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
+from app.models import User
+from utils import llm
+
+admin_bp = Blueprint('admin', __name__)
 
 @admin_bp.route('/admin')
 @login_required
 def admin_panel():
     if not current_user.is_admin:
         flash('Unauthorized Access!', 'danger')
-        return redirect(url_for('main.dashboard'))
+        return redirect(url_for('processor.dashboard'))
         
     users = User.query.all()
-    return render_template('admin.html', users=users)
\ No newline at end of file
+    return render_template('admin.html', users=users, ai_status=llm.status())
+
+@admin_bp.route('/admin/ai-status')
+@login_required
+def ai_status():
+    """Circuit breakers, routing, latency and cache stats (breakers are shared, the rest is per worker)."""
+    if not current_user.is_admin:
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(llm.status())
@@ -1,11 +1,9 @@
 from flask import Blueprint, render_template, request, jsonify, session
-from flask_login import login_required
-from app.models import Lecture, db 
-import os
-from groq import Groq
-
-
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+from flask_login import login_required, current_user
+from app.models import Lecture, ProfessorChat, db 
+from utils import llm
+from utils.retrieval import retrieve_context
+from utils.chat_memory import get_chat, chat_turns, build_messages, record_turn, CHAT_CONTEXT_TOKENS
 
 chatproff_bp = Blueprint('chatproff', __name__)
 
@@ -15,7 +13,8 @@ def professor_office():
     # Get the last lecture to provide context for the "Office Hours"
     lecture_id = session.get('classroom_lecture_id')
     lecture = db.session.get(Lecture, lecture_id) if lecture_id else None
-    return render_template('chatproff.html', lecture=lecture)
+    chat = ProfessorChat.query.filter_by(user_id=current_user.id, lecture_id=lecture.id if lecture else None).first()
+    return render_template('chatproff.html', lecture=lecture, history=chat_turns(chat) if chat else [])
 
 @chatproff_bp.route('/chat-professor', methods=['POST'])
 @login_required
@@ -23,27 +22,28 @@ def chat_professor():
     user_message = request.json.get('message')
     lecture_id = session.get('classroom_lecture_id')
     
-    # Context Retrieval
+    # Context Retrieval: only the passages that match this question (and the previous one, for follow-ups)
     lecture = db.session.get(Lecture, lecture_id) if lecture_id else None
-    context = lecture.transcript if lecture else "General academic knowledge."
+    chat = get_chat(current_user.id, lecture.id if lecture else None)
+    if lecture:
+        previous = [turn['content'] for turn in chat_turns(chat) if turn['role'] == 'user'][-1:]
+        context = retrieve_context(lecture, " ".join(previous + [user_message or ""]), max_tokens=CHAT_CONTEXT_TOKENS)
+    else:
+        context = "General academic knowledge."
 
     system_prompt = (
         "You are 'Professor StudAI', a helpful, witty, and brilliant academic mentor. "
         "Your tone is encouraging, clear, and professional. "
-        f"Base your expertise on this context: {context[:6000]}"
+        f"Base your expertise on this context: {context}"
     )
 
     try:
         # Update the model name as per your provider
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
-        )
-        answer = response.choices[0].message.content
+        answer = llm.complete(build_messages(chat, system_prompt, user_message or ""), route="chat_professor",
+                              priority=llm.INTERACTIVE)
+        record_turn(chat, user_message or "", answer)
         return jsonify({"answer": answer})
     except Exception as e:
+        db.session.rollback()
         print(f"DEBUG ERROR: {str(e)}") # This will show up in your terminal
-        return jsonify({"answer": "I'm currently reviewing some papers. Try again in a second!"}), 500
\ No newline at end of file
+        return jsonify({"answer": "I'm currently reviewing some papers. Try again in a second!"}), 500
@@ -3,16 +3,53 @@ import base64
 import os
 import io
 import time
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
+import threading
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, Response, stream_with_context, current_app
 from flask_login import login_required, current_user
-from app.models import db, Lecture
-from groq import Groq
-from utils.text_extractor import extract_text_from_file
+from app.models import db, Lecture, ClassSession
+from utils.ingest import extract_files
 from utils.billing import can_process, spend_credit
-from datetime import datetime, timezone
+from utils.summarizer import ai_assistant
+from utils import llm
+from utils.chunker import clip_to_tokens
+from utils.retrieval import retrieve_context, save_lecture_index
+from utils.module_store import load_module_content, save_module_content
+from utils.chunk_store import load_chunk_summaries, save_chunk_summaries
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_
 
 classroom_bp = Blueprint('classroom', __name__)
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+# Bump when the teaching prompt changes so cached module bodies are regenerated
+MODULE_PROMPT_VERSION = "1"
+# How long a request waits for a module that is already being prefetched
+MODULE_PREFETCH_WAIT = int(os.environ.get("MODULE_PREFETCH_WAIT", 90))
+
+MODULE_SYSTEM_PROMPT = """
+    You are 'Professor StudyBot', a world-class Socratic teacher. 
+    Your goal is to make the student UNDERSTAND, not just read.
+    
+    Follow this strict teaching flow:
+    1. THE HOOK: Why does this specific module matter in the real world? (1-2 sentences)
+    2. THE ANALOGY: Explain the core concept using a simple, relatable story.
+    3. THE DEEP DIVE: Use the provided context to explain the technical details clearly in Markdown.
+    4. THE CHECKPOINT: End with a friendly question asking if they want a deeper dive or a simpler example.
+    """
+
+# Prompt budget for ask_tutor: retrieved lecture passages and the student's question
+TUTOR_CONTEXT_TOKENS = int(os.environ.get("TUTOR_CONTEXT_TOKENS", 1200))
+TUTOR_QUESTION_TOKENS = 500
+
+# Teach module 1 from the opening chunk while the syllabus is planned in the background
+CLASSROOM_PROGRESSIVE_INIT = os.environ.get("CLASSROOM_PROGRESSIVE_INIT", "1") == "1"
+PROVISIONAL_CONTEXT_TOKENS = 1500
+# How long a student who outran the provisional syllabus waits for the full one
+CLASSROOM_REFINE_WAIT = int(os.environ.get("CLASSROOM_REFINE_WAIT", 180))
+# After this many seconds a refinement claimed by a worker that died may be claimed again
+CLASSROOM_REFINE_LEASE = int(os.environ.get("CLASSROOM_REFINE_LEASE", 600))
+
+# Modules being generated in the background, keyed by (lecture, module index, prompt version)
+_prefetching = {}
+_prefetch_lock = threading.Lock()
 
 # --- CORE ROUTES ---
 
@@ -35,18 +72,7 @@ def start_class():
         flash("Please upload a document to start the class.", "warning")
         return redirect(url_for('classroom.classroom_selection'))
 
-    combined_text = ""
-    for file in files:
-        if file.filename == '': continue
-        try:
-            text = extract_text_from_file(file)
-            if text and len(text.strip()) > 0:
-                combined_text += text + "\n"
-                print(f"✅ Extracted {len(text)} chars from {file.filename}")
-            else:
-                print(f"⚠️ Extraction returned no text for {file.filename}")
-        except Exception as e:
-            print(f"❌ Extraction error for {file.filename}: {e}")
+    combined_text, _ = extract_files(files)
 
     if len(combined_text.strip()) < 20:
         flash("The AI couldn't read those notes. Try a clearer file!", "danger")
@@ -63,6 +89,7 @@ def start_class():
     try:
         db.session.add(new_lecture)
         db.session.commit()
+        save_lecture_index(new_lecture.id, combined_text)
         spend_credit(current_user) # Deduct credit
         return redirect(url_for('classroom.init_class', lecture_id=new_lecture.id))
     except Exception as e:
@@ -73,44 +100,112 @@ def start_class():
 @classroom_bp.route('/init-class/<int:lecture_id>')
 @login_required
 def init_class(lecture_id):
+    class_session = get_class_session(lecture_id)
+    syllabus = load_syllabus(class_session)
+    step = (class_session.current_module_index or 0) if class_session else 0
+    refining = is_refining(class_session)
+    if syllabus and not (refining and step >= len(syllabus)):
+        # Reopening a class resumes the saved syllabus; a finished class starts over
+        if step >= len(syllabus):
+            class_session.current_module_index = 0
+            class_session.is_active = True
+            db.session.commit()
+        session['classroom_lecture_id'] = lecture_id
+        return redirect(url_for('classroom.teach_module'))
+
     lecture = db.session.get(Lecture, lecture_id)
     if not lecture:
         flash("Lecture not found.", "danger")
         return redirect(url_for('classroom.classroom_selection'))
 
-    raw_content = lecture.transcript or  lecture.summary or ""
-    global_map = generate_global_summary(raw_content)
-    
-    syllabus_prompt = f"""
-    Based on this Knowledge Map, break the lecture into 4-8 logically sequenced modules. 
-    For each module, provide a title and a 3-word 'search_query' for the original text.
-    Return ONLY JSON: {{ "modules": [ {{ "title": "...", "query": "..." }}, ... ] }}
-    
-    Knowledge Map: {global_map} 
-    """
+    if CLASSROOM_PROGRESSIVE_INIT:
+        # Module 1 is prepared over SSE while the full syllabus is planned in the background
+        session['classroom_lecture_id'] = lecture_id
+        return render_template('classroom_init.html', lecture=lecture)
+
+    if not class_session:
+        class_session = ClassSession(user_id=current_user.id, lecture_id=lecture_id)
+        db.session.add(class_session)
+
+    # The knowledge map is the expensive part, so keep it even if the syllabus call fails
+    if not class_session.knowledge_map:
+        raw_content = lecture.transcript or  lecture.summary or ""
+        class_session.knowledge_map = generate_global_summary(raw_content, lecture_id=lecture.id)
+        db.session.commit()
+
     try:
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user",  "content": syllabus_prompt}],
-            response_format ={"type": "json_object"})
-
-        syllabus_data =json.loads( completion.choices[0].message.content)
-        session['classroom_syllabus'] = syllabus_data.get('modules', [])
-        session['classroom_step'] = 0
+        class_session.modules_json = json.dumps(build_syllabus(class_session.knowledge_map))
+        class_session.current_module_index = 0
+        class_session.syllabus_ready = True
+        class_session.is_active = True
+        db.session.commit()
         session['classroom_lecture_id'] = lecture_id
         
         return redirect(url_for('classroom.teach_module'))
     except Exception as e:
+        db.session.rollback()
         flash(f"Classroom Init Failed: {str(e)}", "danger")
         return redirect(url_for('classroom.classroom_selection'))
+
+@classroom_bp.route('/init-class-stream/<int:lecture_id>')
+@login_required
+def init_class_stream(lecture_id):
+    lecture = db.session.get(Lecture, lecture_id)
+    app = current_app._get_current_object()
+    user_id = current_user.id
+    session['classroom_lecture_id'] = lecture_id
+
+    def generate():
+        if not lecture:
+            yield f"data: {json.dumps({'msg': '❌ Lecture not found.', 'class': 'text-danger'})}\n\n"
+            return
+        try:
+            class_session = get_class_session(lecture_id)
+            if not load_syllabus(class_session):
+                yield f"data: {json.dumps({'msg': '>>> READING THE OPENING OF YOUR NOTES...', 'class': 'text-warning'})}\n\n"
+                module = provisional_module(lecture)
+                if not class_session:
+                    class_session = ClassSession(user_id=user_id, lecture_id=lecture_id)
+                    db.session.add(class_session)
+                class_session.modules_json = json.dumps([module])
+                class_session.current_module_index = 0
+                class_session.syllabus_ready = False
+                class_session.is_active = True
+                db.session.commit()
+                ready_msg = f"✅ MODULE 1 READY: {module['title']}"
+                yield f"data: {json.dumps({'msg': ready_msg, 'class': 'text-success'})}\n\n"
+
+            if is_refining(class_session):
+                refine_syllabus(app, user_id, lecture_id)
+                yield f"data: {json.dumps({'msg': '>>> PLANNING THE REST OF THE COURSE IN THE BACKGROUND...', 'class': 'text-info'})}\n\n"
+
+                # A student who has already finished the provisional modules waits for the full syllabus
+                waited = 0
+                while is_refining(class_session) and (class_session.current_module_index or 0) >= len(load_syllabus(class_session)):
+                    if waited >= CLASSROOM_REFINE_WAIT:
+                        yield f"data: {json.dumps({'msg': '❌ The syllabus is taking too long. Please try again shortly.', 'class': 'text-danger'})}\n\n"
+                        return
+                    time.sleep(1)
+                    waited += 1
+                    db.session.expire(class_session)
+
+            yield f"data: {json.dumps({'message': '____FINISHED____', 'redirect': url_for('classroom.teach_module')})}\n\n"
+        except Exception as e:
+            db.session.rollback()
+            yield f"data: {json.dumps({'msg': f'❌ Classroom Init Failed: {str(e)}', 'class': 'text-danger'})}\n\n"
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
     
 @classroom_bp.route('/teach')
 @login_required
 def teach_module():
     lecture_id = session.get('classroom_lecture_id')
-    step = session.get('classroom_step', 0)
-    syllabus = session.get('classroom_syllabus', [])
+    class_session = get_class_session(lecture_id)
+    syllabus = load_syllabus(class_session)
+    step = (class_session.current_module_index or 0) if class_session else 0
+    refining = is_refining(class_session)
 
+    if lecture_id and refining and step >= len(syllabus):
+        return redirect(url_for('classroom.init_class', lecture_id=lecture_id))
     if not lecture_id or step >= len(syllabus):
         return redirect(url_for('classroom.classroom_selection'))
 
@@ -118,6 +213,7 @@ def teach_module():
                            module_title=syllabus[step]['title'] if isinstance(syllabus[step], dict) else syllabus[step],
                            step=step + 1,
                            total_steps=len(syllabus),
+                           refining=refining,
                            lecture_id=lecture_id)
 
 
@@ -126,104 +222,241 @@ def teach_module():
 def ask_tutor():
     question = request.form.get('question', '')
     module_title = request.form.get('module_title', '')
-    
-    response = client.chat.completions.create(
-        messages=[
-            {"role": "system", "content": f"You are a Professor teaching: {module_title}"},
-            {"role": "user", "content": question}
-        ],
-        model="llama-3.3-70b-versatile",
-    )
-    return jsonify({"answer": response.choices[0].message.content})
+    lecture_id = session.get('classroom_lecture_id')
+    lecture = db.session.get(Lecture, lecture_id) if lecture_id else None
+
+    # Ground the answer in the lecture passages that match the question, within a fixed budget
+    system_prompt = f"You are a Professor teaching: {module_title}"
+    if lecture:
+        context = retrieve_context(lecture, f"{module_title} {question}", max_tokens=TUTOR_CONTEXT_TOKENS)
+        system_prompt += (". Answer from the lecture notes below; if they don't cover the question, say so "
+                          f"and answer from general knowledge.\n\nLecture notes: {context}")
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": clip_to_tokens(question, TUTOR_QUESTION_TOKENS)}
+    ]
+
+    def generate():
+        try:
+            for content in llm.stream(messages, route="ask_tutor"):
+                yield f"data: {json.dumps({'msg': content})}\n\n"
+            yield f"data: {json.dumps({'msg': '____FINISHED____'})}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'msg': f'❌ Error: {str(e)}'})}\n\n"
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
 @classroom_bp.route('/next-module')
 @login_required
 def next_module():
-    session['classroom_step'] = session.get('classroom_step', 0) + 1
+    class_session = get_class_session(session.get('classroom_lecture_id'))
+    if class_session:
+        class_session.current_module_index = (class_session.current_module_index or 0) + 1
+        class_session.is_active = is_refining(class_session) or \
+            class_session.current_module_index < len(load_syllabus(class_session))
+        db.session.commit()
     return redirect(url_for('classroom.teach_module'))
 
-def find_relevant_chunk(full_text, query, window_size=15000):
-    import re
-    if not query: return full_text[:window_size]
+def get_class_session(lecture_id):
+    """The current student's saved class (syllabus, knowledge map and progress) for a lecture."""
+    if not lecture_id:
+        return None
+    return ClassSession.query.filter_by(user_id=current_user.id, lecture_id=lecture_id).first()
 
-    match = re.search(re.escape(query.lower()), full_text.lower())
-    if match:
-        start = max(0, match.start() - 2000)
-        end = min(len(full_text), start + window_size)
-        return full_text[start:end]
-    return full_text[:window_size]
-        
+def load_syllabus(class_session):
+    if not class_session or not class_session.modules_json:
+        return []
+    try:
+        return json.loads(class_session.modules_json)
+    except ValueError:
+        return []
+
+def is_refining(class_session):
+    """True while a class is running on a provisional syllabus."""
+    return class_session is not None and class_session.syllabus_ready is False
+
+def build_syllabus(global_map):
+    syllabus_prompt = f"""
+    Based on this Knowledge Map, break the lecture into 4-8 logically sequenced modules. 
+    For each module, provide a title and a 3-word 'search_query' for the original text.
+    Return ONLY JSON: {{ "modules": [ {{ "title": "...", "query": "..." }}, ... ] }}
+    
+    Knowledge Map: {global_map} 
+    """
+    syllabus_data = json.loads(llm.complete(
+        [{"role": "user",  "content": syllabus_prompt}],
+        model=llm.SMART_MODEL, cache=True,
+        response_format ={"type": "json_object"}))
+    return syllabus_data.get('modules', [])
+
+def provisional_module(lecture):
+    """A first module taken from the opening of the lecture, so teaching can start before the syllabus exists."""
+    opening = clip_to_tokens(lecture.transcript or lecture.summary or "", PROVISIONAL_CONTEXT_TOKENS)
+    prompt = f"""
+    This is the opening of a lecture. Name the first module a student should learn from it.
+    Provide a title and a 3-word 'search_query' for the original text.
+    Return ONLY JSON: {{ "title": "...", "query": "..." }}
+
+    Opening: {opening}
+    """
+    try:
+        data = json.loads(llm.complete(
+            [{"role": "user", "content": prompt}],
+            model=llm.FAST_MODEL, kind="fast", cache=True, priority=llm.INTERACTIVE,
+            response_format={"type": "json_object"}))
+        title = str(data.get('title') or "").strip()
+        if title:
+            return {"title": title, "query": str(data.get('query') or "")}
+    except Exception as e:
+        print(f"Provisional module failed: {e}")
+    return {"title": f"Introduction: {lecture.title}", "query": ""}
+
+def refine_syllabus(app, user_id, lecture_id):
+    """Builds the knowledge map and full syllabus in a background thread, unless any worker is already on it."""
+    # Claiming the class row is atomic, so of several gunicorn workers only one wins
+    now = datetime.utcnow()
+    claimed = ClassSession.query.filter(
+        ClassSession.user_id == user_id, ClassSession.lecture_id == lecture_id,
+        ClassSession.syllabus_ready.is_(False),
+        or_(ClassSession.refine_started_at.is_(None),
+            ClassSession.refine_started_at < now - timedelta(seconds=CLASSROOM_REFINE_LEASE)),
+    ).update({ClassSession.refine_started_at: now}, synchronize_session=False)
+    db.session.commit()
+    if claimed:
+        threading.Thread(target=_refine, args=(app, (user_id, lecture_id)), daemon=True).start()
+
+def _refine(app, key):
+    user_id, lecture_id = key
+    try:
+        with app.app_context():
+            class_session = ClassSession.query.filter_by(user_id=user_id, lecture_id=lecture_id).first()
+            lecture = db.session.get(Lecture, lecture_id)
+            if not is_refining(class_session) or not lecture:
+                return
+            if not class_session.knowledge_map:
+                raw_content = lecture.transcript or  lecture.summary or ""
+                class_session.knowledge_map = generate_global_summary(raw_content, lecture_id=lecture_id)
+                db.session.commit()
+            modules = build_syllabus(class_session.knowledge_map)
+
+            # Keep the modules the student has already reached and plan the rest from the full syllabus
+            db.session.refresh(class_session)
+            taught = load_syllabus(class_session)[:(class_session.current_module_index or 0) + 1]
+            class_session.modules_json = json.dumps(taught + modules[len(taught):])
+            class_session.syllabus_ready = True
+            db.session.commit()
+    except Exception as e:
+        print(f"Syllabus refinement failed: {e}")
+    finally:
+        # Release the claim, so a failed refinement is retried on the next visit
+        with app.app_context():
+            ClassSession.query.filter_by(user_id=user_id, lecture_id=lecture_id).update(
+                {ClassSession.refine_started_at: None}, synchronize_session=False)
+            db.session.commit()
 
 @classroom_bp.route('/stream-module-content')
 @login_required
 def stream_module_content():
     lecture_id = session.get('classroom_lecture_id')
-    step = session.get('classroom_step', 0)
-    syllabus = session.get('classroom_syllabus', []) 
+    class_session = get_class_session(lecture_id)
+    syllabus = load_syllabus(class_session)
+    step = (class_session.current_module_index or 0) if class_session else 0
     
     lecture = db.session.get(Lecture, lecture_id)
-    raw_content = lecture.transcript or ""
-    
-    current_module = syllabus[step] if step < len(syllabus) else {"title": "Summary", "query": ""}
     
-    context_chunk = find_relevant_chunk(raw_content, current_module.get('query'))
+    current_module = module_at(syllabus, step)
+
+    # Start on the next module now so it is ready when the student presses Next
+    prefetch_module(current_app._get_current_object(), lecture_id, step + 1, module_at(syllabus, step + 1))
+
+    cached = load_module_content(lecture_id, step, current_module['title'], MODULE_PROMPT_VERSION)
+    if cached is None:
+        cached = wait_for_prefetch(lecture_id, step, current_module['title'])
+    if cached is not None:
+        def replay():
+            yield f"data: {json.dumps({'msg': cached})}\n\n"
+            yield f"data: {json.dumps({'msg': '____FINISHED____'})}\n\n"
+        return Response(replay(), mimetype='text/event-stream')
+
+    messages = module_messages(lecture, current_module)
     def generate():
         try:
-            system_instruction = """
-            You are 'Professor StudyBot', a world-class Socratic teacher. 
-            Your goal is to make the student UNDERSTAND, not just read.
-            
-            Follow this strict teaching flow:
-            1. THE HOOK: Why does this specific module matter in the real world? (1-2 sentences)
-            2. THE ANALOGY: Explain the core concept using a simple, relatable story.
-            3. THE DEEP DIVE: Use the provided context to explain the technical details clearly in Markdown.
-            4. THE CHECKPOINT: End with a friendly question asking if they want a deeper dive or a simpler example.
-            """
-            
-            response_stream = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": f"Teach Module: {current_module['title']}. \n\nContext from PDF: {context_chunk}"}
-                ],
-                stream=True
-            )
-            for chunk in response_stream:
-                if chunk.choices[0].delta.content:
-                    yield f"data: {json.dumps({'msg': chunk.choices[0].delta.content})}\n\n"
+            parts = []
+            for content in llm.stream(messages, model=llm.SMART_MODEL):
+                parts.append(content)
+                yield f"data: {json.dumps({'msg': content})}\n\n"
+            save_module_content(lecture_id, step, current_module['title'], MODULE_PROMPT_VERSION, "".join(parts))
             
             yield f"data: {json.dumps({'msg': '____FINISHED____'})}\n\n"
                     
         except Exception as e:
             yield f"data: {json.dumps({'msg': f'❌ Error: {str(e)}'})}\n\n"
     return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+def module_at(syllabus, step):
+    if step >= len(syllabus):
+        return {"title": "Summary", "query": ""}
+    module = syllabus[step]
+    return module if isinstance(module, dict) else {"title": str(module), "query": ""}
+
+def module_messages(lecture, module):
+    # Top BM25 passages for the module, from the index built when the lecture was ingested
+    context_chunk = retrieve_context(lecture, f"{module.get('title', '')} {module.get('query', '')}")
+    return [
+        {"role": "system", "content": MODULE_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Teach Module: {module['title']}. \n\nContext from PDF: {context_chunk}"}
+    ]
+
+def prefetch_module(app, lecture_id, step, module):
+    """Generates and stores a module body in a background thread, unless it is cached or already running."""
+    if not lecture_id or module['title'] == "Summary":
+        return
+    key = (lecture_id, step, MODULE_PROMPT_VERSION)
+    with _prefetch_lock:
+        if key in _prefetching:
+            return
+        _prefetching[key] = threading.Event()
+    threading.Thread(target=_prefetch, args=(app, key, module), daemon=True).start()
+
+def wait_for_prefetch(lecture_id, step, title):
+    """If this module is being prefetched, waits for it instead of generating it a second time."""
+    with _prefetch_lock:
+        done = _prefetching.get((lecture_id, step, MODULE_PROMPT_VERSION))
+    if not done or not done.wait(MODULE_PREFETCH_WAIT):
+        return None
+    return load_module_content(lecture_id, step, title, MODULE_PROMPT_VERSION)
+
+def _prefetch(app, key, module):
+    lecture_id, step, version = key
+    try:
+        with app.app_context():
+            if load_module_content(lecture_id, step, module['title'], version) is not None:
+                return
+            lecture = db.session.get(Lecture, lecture_id)
+            if not lecture:
+                return
+            content = llm.complete(module_messages(lecture, module), model=llm.SMART_MODEL, priority=llm.BACKGROUND)
+            save_module_content(lecture_id, step, module['title'], version, content)
+    except Exception as e:
+        print(f"Module prefetch failed: {e}")
+    finally:
+        with _prefetch_lock:
+            _prefetching.pop(key).set()
     
-def generate_global_summary(full_text):
-    """Scans and summarizes large documents in chunks to create a Knowledge Map."""
-    chunk_size = 15000  # ~2500 words per chunk
-    overlap = 1000
-    chunks = []
-    
-    # Split text into chunks
-    for i in range(0, len(full_text), chunk_size - overlap):
-        chunks.append(full_text[i:i + chunk_size])
-    
-    # We take up to 20 segments (covers about 150-200 pages)
-    chunk_summaries = []
-    for idx, chunk in enumerate(chunks[:20]): 
-        prompt = f"Summarize the key educational topics in this section of the document. Part {idx+1}:\n\n{chunk}"
-        try:
-            # Using a faster model for intermediate steps to save time
-            completion = client.chat.completions.create(
-                model="llama-3.1-8b-instant", 
-                messages=[{"role": "user", "content": prompt}]
-            )
-            chunk_summaries.append(completion.choices[0].message.content)
-        except:
-            continue
-            
+def generate_global_summary(full_text, lecture_id=None):
+    """Scans and summarizes large documents to create a Knowledge Map.
+    Uses the shared recursive map-reduce, so no part of a long document is dropped,
+    and reuses the lecture's stored chunk summaries so known chunks cost no LLM calls."""
+    try:
+        collected = {}
+        combined_summary = ai_assistant.condense_text(full_text, known=load_chunk_summaries(lecture_id), collect=collected)
+        save_chunk_summaries(lecture_id, collected)
+    except:
+        return clip_to_tokens(full_text, 3750) # Fallback if AI fails
+    if not (combined_summary or "").strip():
+        # An empty prompt is the same for every lecture, so its cached map would leak across lectures
+        return clip_to_tokens(full_text, 3750)
+
     # Combine summaries into a final Knowledge Map
-    combined_summary = "\n\n".join(chunk_summaries)
     final_prompt = f"""
     Create a detailed Knowledge Map of this entire document based on these summaries. 
     Identify the main themes and the order of topics.
@@ -231,10 +464,6 @@ def generate_global_summary(full_text):
     """
     
     try:
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": final_prompt}]
-        )
-        return completion.choices[0].message.content
+        return llm.complete([{"role": "user", "content": final_prompt}], model=llm.SMART_MODEL, cache=True)
     except:
-        return full_text[:15000] # Fallback if AI fails
+        return clip_to_tokens(full_text, 3750) # Fallback if AI fails
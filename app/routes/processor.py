@@ -5,7 +5,10 @@ from flask import Blueprint, request, render_template, current_app, flash, redir
 from flask_login import login_required, current_user
 from app.models import db, Lecture
 from utils.documenter import save_study_notes
-from utils.text_extractor import extract_text_from_file
+from utils.text_extractor import iter_text_from_file
+from utils.ingest import RssMonitor
+from utils.chunk_store import save_chunk_summaries
+from utils.retrieval import save_lecture_index
 from utils.billing import can_process, spend_credit
 
 processor_bp = Blueprint('processor', __name__)
@@ -53,13 +56,27 @@ def process_log(filename):
         transcript_text = ""
         ext = filename.lower().split('.')[-1]
         
+        early_map = None
         if ext in ['pdf', 'docx', 'png', 'jpg', 'jpeg', 'webp', 'txt']:
             yield f"data: {json.dumps({'msg': '>>> DETECTED DOCUMENT FORMAT. INITIALIZING AI PROFESSOR...', 'class': 'text-warning'})}\n\n"
             try:
-                transcript_text = extract_text_from_file(file_path)
+                from utils.summarizer import ai_assistant
+                # Summaries of the opening chunks start while later pages are still being read
+                early_map = ai_assistant.start_map()
+                pages = []
+                with RssMonitor() as monitor:
+                    for page_no, page_text in iter_text_from_file(file_path):
+                        pages.append(page_text)
+                        early_map.feed(page_text)
+                        yield f"data: {json.dumps({'msg': f'>>> PAGE {page_no} READ ({len(page_text.strip())} chars)', 'class': 'text-info'})}\n\n"
+                        monitor.check()
+                transcript_text = "".join(pages)
+                yield f"data: {json.dumps({'msg': f'>>> PEAK MEMORY DURING EXTRACTION: {monitor.peak_mb:.0f}MB', 'class': 'text-info'})}\n\n"
                 if transcript_text:
                     yield f"data: {json.dumps({'msg': '✅ TEXT EXTRACTION SUCCESSFUL.', 'class': 'text-success'})}\n\n"
             except Exception as e:
+                if early_map:
+                    early_map.close()
                 yield f"data: {json.dumps({'msg': f'❌ EXTRACTION ERROR: {str(e)}', 'class': 'text-danger fw-bold'})}\n\n"
                 return
         else:
@@ -80,13 +97,17 @@ def process_log(filename):
             return
 
         summary_text = "" 
+        chunk_summaries = {}
         try:
             yield f"data: {json.dumps({'msg': '>>> ANALYZING CONTENT...', 'class': 'text-warning'})}\n\n"
-            from utils.summarizer import ai_assistant
+            from utils.summarizer import ai_assistant, MapProgress
             
             summary_chunks = []
-            for chunk, final in ai_assistant.get_study_notes(transcript_text):
-                if chunk:
+            for chunk, final in ai_assistant.get_study_notes(transcript_text, early_map=early_map, progress=True,
+                                                              collect=chunk_summaries):
+                if isinstance(chunk, MapProgress):
+                    yield f"data: {json.dumps({'msg': str(chunk), 'class': 'text-info'})}\n\n"
+                elif chunk:
                     summary_chunks.append(chunk)
                 if final:
                     summary_text = final
@@ -97,6 +118,9 @@ def process_log(filename):
         except Exception as e:
             summary_text = f"Summary failed. Error: {str(e)}"
             yield f"data: {json.dumps({'msg': f'⚠️ AI Summary Error: {str(e)}', 'class': 'text-info'})}\n\n"
+        finally:
+            if early_map:
+                early_map.close()
 
         try:
             new_lecture = Lecture(
@@ -109,6 +133,9 @@ def process_log(filename):
             )
             db.session.add(new_lecture)
             db.session.commit()
+            # Classroom and quiz reuse these instead of summarizing the same chunks again
+            save_chunk_summaries(new_lecture.id, chunk_summaries)
+            save_lecture_index(new_lecture.id, transcript_text)
 
             output_filename = f"output_{new_lecture.id}.{export_format}"
             output_path = os.path.join('output', output_filename)
@@ -1,19 +1,20 @@
-import os
 import json
-import base64
-import io
 from datetime import datetime, timezone
-from flask import Blueprint, render_template, request, redirect, url_for, current_app, flash, session, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, current_app, flash, session
 from flask_login import login_required, current_user
 from rapidfuzz import fuzz
-from groq import Groq
 from app.models import db, Lecture, Quiz  
 from utils.summarizer import ai_assistant
-from utils.text_extractor import extract_text_from_file
+from utils import llm
+from utils.ingest import extract_files
+from utils.chunker import clip_to_tokens
+from utils.chunk_store import load_chunk_summaries
+from utils.retrieval import save_lecture_index
 from utils.billing import can_process, spend_credit
 
 quiz_bp = Blueprint('quiz', __name__)
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+
+QUIZ_CACHE_TTL = 3600
 
 # --- ROUTES ---
 
@@ -45,13 +46,10 @@ def start_quiz():
         flash("Please upload a document/photo or select from your library!", "warning")
         return redirect(url_for('quiz.quiz_selection'))
 
-    combined_text = ""
-    for file in files:
-        if not file or file.filename == '': continue
-        try:
-            combined_text += extract_text_from_file(file) + "\n"
-        except Exception as e:
-            current_app.logger.error(f"Extraction Error for {file.filename}: {e}")
+    combined_text, report = extract_files(files)
+    for entry in report:
+        if entry["error"]:
+            current_app.logger.error(f"Extraction Error for {entry['filename']}: {entry['error']}")
 
     if len(combined_text.strip()) < 20:
         flash("The AI couldn't read those notes. Try a clearer file!", "danger")
@@ -69,6 +67,7 @@ def start_quiz():
     try:
         db.session.add(new_lecture)
         db.session.commit()
+        save_lecture_index(new_lecture.id, combined_text)
         spend_credit(current_user) # Deduct credit for doc processing
         return redirect(url_for('quiz.run_exam', lecture_id=new_lecture.id, count=num_questions))
     except Exception as e:
@@ -95,6 +94,9 @@ def run_exam(lecture_id, count):
         flash("No content found to generate a quiz.", "warning")
         return redirect(url_for('quiz.quiz_selection'))
 
+    # Long lectures that were already summarized are quizzed on the whole digest, not just the opening pages
+    quiz_context = ai_assistant.known_digest(raw_text, load_chunk_summaries(lecture.id), 3000) or clip_to_tokens(raw_text, 1500)
+
     math_keywords = ['=', '+', '/', '*', 'calculate', 'solve', 'formula', 'x', 'y']
     is_calc = any(word in raw_text.lower() for word in math_keywords)
     total_seconds = count * (180 if is_calc else 90)
@@ -110,16 +112,17 @@ def run_exam(lecture_id, count):
         ]
     }}
     CRITICAL: For 'objective' questions, 'ans' must be the FULL TEXT of the correct option.
-    Text: {raw_text[:6000]}
+    Text: {quiz_context}
     """
 
     try:
-        completion = ai_assistant.client.chat.completions.create(
-            model=ai_assistant.model,
-            messages=[{"role": "user", "content": prompt}],
+        quiz_data = json.loads(llm.complete(
+            [{"role": "user", "content": prompt}],
+            model=llm.SMART_MODEL,
+            # Reloads and double submits reuse the quiz; a later practice run gets fresh questions
+            cache=True, ttl=QUIZ_CACHE_TTL,
             response_format={"type": "json_object"}
-        )
-        quiz_data = json.loads(completion.choices[0].message.content)
+        ))
         spend_credit(current_user) # Deduct credit for AI generation
         session['current_quiz'] = quiz_data['questions']
         
@@ -177,11 +180,7 @@ def submit_quiz():
         
     advice_prompt = f"Student scored {score}/{len(quiz_questions)}. Failed topics: {failed_qs[:2]}. Give a 2-sentence tip."
     try:
-        fb = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": advice_prompt}]
-        )
-        tutor_advice = fb.choices[0].message.content
+        tutor_advice = llm.complete([{"role": "user", "content": advice_prompt}], route="quiz_feedback")
     except:
         tutor_advice = "Good job! Keep studying."
 
@@ -249,10 +248,7 @@ def grade_theory_answer(question, student_answer, model_answer):
     Return ONLY 'CORRECT' or 'INCORRECT'.
     """
     try:
-        res = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return "CORRECT" in res.choices[0].message.content.upper()
+        verdict = llm.complete([{"role": "user", "content": prompt}], model=llm.FAST_MODEL, kind="fast", cache=True)
+        return "CORRECT" in verdict.upper()
     except:
         return False
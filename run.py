@@ -6,7 +6,7 @@ if __name__ == '__main__':
     with app.app_context():
         # This is the "Magic" line. Importing them here registers them 
         # inside the application context so db.create_all() sees them.
-        from app.models import User, Lecture, Quiz, ClassSession
+        from app.models import User, Lecture, Quiz, ClassSession, ChunkSummary, LectureIndex, ModuleContent, ProfessorChat
         
         try:
             db.create_all()
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.environ.get("STUDYBOT_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache')
+
+
+class SharedSqlite:
+    """
+    A SQLite file in CACHE_DIR shared by every thread and gunicorn worker on the box.
+    autocommit=True leaves transactions to the caller (explicit BEGIN IMMEDIATE / COMMIT).
+    """
+
+    def __init__(self, name, autocommit=False):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.path = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+        self.autocommit = autocommit
+        self._local = threading.local()
+
+    def connect(self):
+        # One connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            if self.autocommit:
+                conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            else:
+                conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class DiskCache:
+    """
+    Small key/value store on local disk with size-bounded LRU eviction and optional TTL.
+    Backed by SQLite so every thread and every gunicorn worker on the box shares it.
+    """
+
+    def __init__(self, name, max_bytes, ttl=None):
+        self._db = SharedSqlite(name)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        with self._db.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    expires_at REAL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries (last_used)")
+            # Cache files created before entries could expire
+            if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(entries)")]
+                if "expires_at" not in columns:
+                    conn.execute("ALTER TABLE entries ADD COLUMN expires_at REAL")
+                conn.execute("PRAGMA user_version = 1")
+
+    def get(self, key):
+        now = time.time()
+        with self._db.connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] <= now:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value, ttl=None):
+        """Stores value; ttl (seconds, default the cache's own) makes it expire, None keeps it until evicted."""
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_used, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now + ttl if ttl else None))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Drops expired entries, then least recently used ones until the cache fits in max_bytes."""
+        conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used ASC").fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
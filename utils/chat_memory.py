@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+from flask import current_app
+from sqlalchemy.orm.exc import StaleDataError
+from app.models import db, ProfessorChat
+from utils import llm
+from utils.chunker import clip_to_tokens, estimate_tokens
+
+# Fixed prompt budget per turn, so long conversations cost the same as short ones
+CHAT_HISTORY_TOKENS = int(os.environ.get("CHAT_HISTORY_TOKENS", 1200))
+CHAT_SUMMARY_TOKENS = int(os.environ.get("CHAT_SUMMARY_TOKENS", 300))
+CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", 1000))
+CHAT_MESSAGE_TOKENS = 500
+# Recent turns may run this far over CHAT_HISTORY_TOKENS before the oldest are compacted,
+# so the summary is rewritten every few turns instead of on every one
+CHAT_COMPACT_MARGIN = int(os.environ.get("CHAT_COMPACT_MARGIN", 600))
+
+_compacting = set()
+_compacting_lock = threading.Lock()
+
+
+def get_chat(user_id, lecture_id):
+    """The stored office-hours conversation for a student and lecture, created on first use."""
+    chat = ProfessorChat.query.filter_by(user_id=user_id, lecture_id=lecture_id).first()
+    if not chat:
+        chat = ProfessorChat(user_id=user_id, lecture_id=lecture_id, summary="", turns_json="[]")
+        db.session.add(chat)
+    return chat
+
+
+def chat_turns(chat):
+    try:
+        return json.loads(chat.turns_json or "[]")
+    except ValueError:
+        return []
+
+
+def build_messages(chat, system_prompt, user_message):
+    """System prompt, rolling summary and recent turns, then the new question."""
+    messages = [{"role": "system", "content": system_prompt}]
+    if chat.summary:
+        messages.append({"role": "system", "content": f"Summary of the conversation so far: {chat.summary}"})
+    messages.extend(_recent(chat_turns(chat)))
+    messages.append({"role": "user", "content": clip_to_tokens(user_message, CHAT_MESSAGE_TOKENS)})
+    return messages
+
+
+def record_turn(chat, user_message, answer):
+    """
+    Appends a question/answer pair; the latest pair is always kept verbatim (clipped to fit).
+    Once the recent turns exceed CHAT_HISTORY_TOKENS + CHAT_COMPACT_MARGIN, the oldest are
+    folded into the rolling summary in a background thread, down to CHAT_HISTORY_TOKENS.
+    """
+    question = clip_to_tokens(user_message, CHAT_MESSAGE_TOKENS)
+    pair = [
+        {"role": "user", "content": question},
+        {"role": "assistant", "content": clip_to_tokens(answer, CHAT_HISTORY_TOKENS - estimate_tokens(question))},
+    ]
+    turns = _update(chat, lambda chat: _append(chat, pair))
+    if turns is None or _history_tokens(turns) <= CHAT_HISTORY_TOKENS + CHAT_COMPACT_MARGIN:
+        return
+    with _compacting_lock:
+        # While the previous compaction is still running, the turns simply wait for the next one
+        if chat.id in _compacting:
+            return
+        _compacting.add(chat.id)
+    threading.Thread(target=_compact, args=(current_app._get_current_object(), chat.id), daemon=True).start()
+
+
+def _append(chat, pair):
+    chat.turns_json = json.dumps(chat_turns(chat) + pair)
+    return True
+
+
+def _update(chat, change, attempts=3):
+    """
+    Applies change(chat) and commits, re-reading the row and trying again when another request
+    or a compaction wrote it in the meantime (the version column catches that).
+    Returns the saved turns, or None if change() declined or the row couldn't be saved.
+    """
+    for attempt in range(attempts):
+        try:
+            if not change(chat):
+                db.session.rollback()
+                return None
+            db.session.commit()
+            return chat_turns(chat)
+        except StaleDataError:
+            db.session.rollback()
+            db.session.refresh(chat)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Chat save failed: {e}")
+            return None
+    print(f"Chat save failed: chat {chat.id} kept changing")
+    return None
+
+
+def _recent(turns):
+    """The newest turns that fit CHAT_HISTORY_TOKENS + CHAT_COMPACT_MARGIN, in case compaction is behind."""
+    while len(turns) > 2 and _history_tokens(turns) > CHAT_HISTORY_TOKENS + CHAT_COMPACT_MARGIN:
+        turns = turns[2:]
+    return turns
+
+
+def _history_tokens(turns):
+    return sum(estimate_tokens(turn["content"]) for turn in turns)
+
+
+def _compact(app, chat_id):
+    """
+    Folds the oldest turns into the summary. The turns stay in turns_json until the new summary
+    is saved, and both change in the same commit, so no request ever sees them missing.
+    """
+    try:
+        with app.app_context():
+            chat = db.session.get(ProfessorChat, chat_id)
+            turns, overflow = chat_turns(chat), []
+            while len(turns) > 2 and _history_tokens(turns) > CHAT_HISTORY_TOKENS:
+                overflow.extend(turns[:2])
+                turns = turns[2:]
+            summary = compact_summary(chat.summary, overflow) if overflow else None
+            db.session.rollback()  # Don't hold the read open across the summary call
+            if summary is None:
+                return
+
+            def fold(chat):
+                # Re-read: newer turns may have been appended since, but the overflow must still lead
+                turns = chat_turns(chat)
+                if turns[:len(overflow)] != overflow:
+                    return False
+                chat.summary = summary
+                chat.turns_json = json.dumps(turns[len(overflow):])
+                return True
+
+            _update(db.session.get(ProfessorChat, chat_id), fold)
+    except Exception as e:
+        print(f"Chat compaction failed: {e}")
+    finally:
+        with _compacting_lock:
+            _compacting.discard(chat_id)
+
+
+def compact_summary(summary, turns):
+    transcript = "\n".join(f"{turn['role'].upper()}: {turn['content']}" for turn in turns)
+    prompt = f"""
+    Update the running summary of a tutoring conversation with the new exchanges below.
+    Keep the student's questions, what was explained and anything they struggled with.
+    Reply with the summary only, under {CHAT_SUMMARY_TOKENS * 3 // 4} words.
+
+    Current summary: {summary or "(none)"}
+
+    New exchanges:
+    {transcript}
+    """
+    try:
+        summary = llm.complete([{"role": "user", "content": prompt}], model=llm.FAST_MODEL, kind="fast",
+                               priority=llm.BACKGROUND)
+        return clip_to_tokens(summary.strip(), CHAT_SUMMARY_TOKENS)
+    except Exception as e:
+        # The turns stay verbatim and the next turn tries again
+        print(f"Chat summary failed: {e}")
+        return None
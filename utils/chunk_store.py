@@ -0,0 +1,26 @@
+from app.models import db, ChunkSummary
+
+
+def load_chunk_summaries(lecture_id):
+    """Returns {chunk_hash: summary} for every chunk summary already stored for a lecture."""
+    if not lecture_id:
+        return {}
+    rows = ChunkSummary.query.filter_by(lecture_id=lecture_id).all()
+    return {row.chunk_hash: row.summary for row in rows}
+
+
+def save_chunk_summaries(lecture_id, collected):
+    """Stores {chunk_hash: (chunk_index, summary)} for a lecture, skipping hashes it already has."""
+    if not lecture_id or not collected:
+        return
+    existing = set(load_chunk_summaries(lecture_id))
+    for chunk_hash, (chunk_index, summary) in collected.items():
+        if chunk_hash not in existing:
+            db.session.add(ChunkSummary(lecture_id=lecture_id, chunk_hash=chunk_hash,
+                                        chunk_index=chunk_index, summary=summary))
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Chunk summary save failed: {e}")
+
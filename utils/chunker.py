@@ -0,0 +1,87 @@
+import re
+from collections import namedtuple
+
+# Rough size of an English token for Llama-family tokenizers
+CHARS_PER_TOKEN = 4
+
+Chunk = namedtuple('Chunk', ['text', 'start', 'end'])
+
+_SENTENCE_END = re.compile(r'[.!?]["\')\]]*\s+')
+
+
+def estimate_tokens(text):
+    return -(-len(text or "") // CHARS_PER_TOKEN)
+
+
+def chunk_text(text, max_tokens, overlap_tokens=0):
+    """
+    Splits text into chunks of at most max_tokens (approximate), cutting on paragraph,
+    then sentence, then word boundaries. Consecutive chunks share about overlap_tokens,
+    snapped to a sentence or word start. Returns Chunk(text, start, end) offsets into text.
+    """
+    chunks = []
+    start = 0
+    while start is not None and start < len(text):
+        end, next_start = chunk_bounds(text, start, max_tokens, overlap_tokens)
+        chunks.append(Chunk(text[start:end], start, end))
+        start = next_start
+    return chunks
+
+
+def clip_to_tokens(text, max_tokens):
+    """The longest prefix of text within max_tokens that ends on a natural boundary."""
+    text = text or ""
+    return text[:chunk_bounds(text, 0, max_tokens, 0)[0]]
+
+
+def chunk_bounds(text, start, max_tokens, overlap_tokens=0, final=True):
+    """
+    Returns (end, next_start) for the chunk that begins at start (next_start is None for the last chunk).
+
+    The cut only depends on text[start:start + max_chars], so while text is still
+    streaming in (final=False) this returns None until enough text has arrived,
+    and the chunks it does return never change once more text is appended.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    limit = start + max_chars
+    if limit >= len(text):
+        if not final:
+            return None
+        return len(text), None
+
+    # Never cut a chunk to less than half its budget just to land on a boundary
+    end = _find_break(text, start + max_chars // 2, limit)
+    next_start = end
+    if overlap_tokens:
+        next_start = _snap_forward(text, max(start + 1, end - overlap_tokens * CHARS_PER_TOKEN), end)
+    return end, next_start
+
+
+def _find_break(text, lo, hi):
+    """Best cut point in text[lo:hi]: paragraph, then sentence, line and word boundaries, else hi."""
+    paragraph = text.rfind("\n\n", lo, hi)
+    if paragraph != -1:
+        return paragraph + 2
+    sentence = None
+    for match in _SENTENCE_END.finditer(text, lo, hi):
+        sentence = match.end()
+    if sentence:
+        return sentence
+    line = text.rfind("\n", lo, hi)
+    if line != -1:
+        return line + 1
+    space = text.rfind(" ", lo, hi)
+    if space != -1:
+        return space + 1
+    return hi
+
+
+def _snap_forward(text, pos, end):
+    """Moves an overlap start forward to the next sentence, or failing that word, start before end."""
+    match = _SENTENCE_END.search(text, pos, end)
+    if match and match.end() < end:
+        return match.end()
+    space = text.find(" ", pos, end)
+    if space != -1 and space + 1 < end:
+        return space + 1
+    return pos
@@ -0,0 +1,123 @@
+import os
+import time
+from utils.cache import SharedSqlite
+
+# Consecutive upstream failures (timeouts, connection errors, 5xx) that open a breaker
+BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 5))
+# Seconds a breaker stays open before one probe request is let through
+BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", 30))
+# How long the probe may run before another caller may probe instead
+BREAKER_PROBE_TIMEOUT = float(os.environ.get("LLM_BREAKER_PROBE_TIMEOUT", 60))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def _refusing(row):
+    state, _, opened_at, probe_until = row
+    now = time.time()
+    if state == OPEN:
+        return now < opened_at + BREAKER_COOLDOWN
+    return state == HALF_OPEN and now < probe_until
+
+
+class CircuitBreakers:
+    """
+    One breaker per upstream endpoint (e.g. "llama-3.3-70b-versatile/chat").
+    After BREAKER_FAILURES failures in a row the breaker opens and calls fail at once with
+    CircuitOpen, so callers drop to their fallbacks instead of waiting out client timeouts.
+    After BREAKER_COOLDOWN a single probe is let through (half-open): success closes the
+    breaker, failure opens it again. State lives in SQLite, so every gunicorn worker trips together.
+    """
+
+    def __init__(self, name="breakers"):
+        self._db = SharedSqlite(name, autocommit=True)
+        with self._db.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS breakers (
+                    name TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    opened_at REAL NOT NULL DEFAULT 0,
+                    probe_until REAL NOT NULL DEFAULT 0,
+                    last_error TEXT
+                )""")
+
+    def _row(self, conn, name):
+        return conn.execute("SELECT state, failures, opened_at, probe_until FROM breakers WHERE name = ?",
+                            (name,)).fetchone()
+
+    def is_open(self, name):
+        """True while calls to name would be refused."""
+        row = self._row(self._db.connect(), name)
+        return row is not None and _refusing(row)
+
+    def allow(self, name):
+        """Raises CircuitOpen unless a call to name may go ahead (possibly as the half-open probe)."""
+        conn = self._db.connect()
+        row = self._row(conn, name)
+        if row is None or row[0] == CLOSED:
+            return
+        if _refusing(row):
+            raise CircuitOpen(f"{name} is unavailable right now, try again shortly")
+        # Cooldown over (or the last probe went silent): claim the probe slot unless another worker just did
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._row(conn, name)
+            probe = row[0] != CLOSED and not _refusing(row)
+            if probe:
+                conn.execute("UPDATE breakers SET state = ?, probe_until = ? WHERE name = ?",
+                             (HALF_OPEN, time.time() + BREAKER_PROBE_TIMEOUT, name))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if probe:
+            print(f"Circuit {name}: half-open, probing")
+        elif row[0] != CLOSED:
+            raise CircuitOpen(f"{name} is unavailable right now, try again shortly")
+
+    def success(self, name):
+        row = self._row(self._db.connect(), name)
+        if row is None or (row[0] == CLOSED and not row[1]):
+            return
+        self._db.connect().execute("UPDATE breakers SET state = ?, failures = 0, probe_until = 0 WHERE name = ?",
+                                (CLOSED, name))
+        if row[0] != CLOSED:
+            print(f"Circuit {name}: closed")
+
+    def failure(self, name, error=None):
+        conn = self._db.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._row(conn, name)
+            state, failures = (row[0], row[1]) if row else (CLOSED, 0)
+            failures += 1
+            opens = state == HALF_OPEN or failures >= BREAKER_FAILURES
+            conn.execute("""
+                INSERT INTO breakers (name, state, failures, opened_at, last_error) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET state = excluded.state, failures = excluded.failures,
+                    opened_at = CASE WHEN excluded.state = 'open' THEN excluded.opened_at ELSE breakers.opened_at END,
+                    last_error = excluded.last_error""",
+                         (name, OPEN if opens else state, failures, time.time(), str(error or "")[:300]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if opens:
+            print(f"Circuit {name}: open after {failures} failures ({error})")
+
+    def states(self):
+        """Every known breaker as {name: {state, failures, retry_in, last_error}}."""
+        now = time.time()
+        rows = self._db.connect().execute(
+            "SELECT name, state, failures, opened_at, probe_until, last_error FROM breakers ORDER BY name").fetchall()
+        return {name: {
+            "state": state,
+            "failures": failures,
+            "retry_in": max(0.0, opened_at + BREAKER_COOLDOWN - now) if state == OPEN else 0.0,
+            "last_error": last_error,
+        } for name, state, failures, opened_at, probe_until, last_error in rows}
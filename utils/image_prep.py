@@ -0,0 +1,86 @@
+import base64
+import io
+import os
+from PIL import Image, ImageOps
+
+# Vision payload limits: long edge in pixels, starting JPEG quality and byte budget per request
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", 1600))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 80))
+IMAGE_MIN_JPEG_QUALITY = 50
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", 1_000_000))
+
+
+def prepare_image(source, for_text=True, max_bytes=None):
+    """
+    Normalizes a photo or rendered page before it is sent to a vision model.
+    Accepts raw image bytes or a PIL image and returns (base64_jpeg, stats).
+
+    Steps: EXIF rotation, downscale to IMAGE_MAX_EDGE, grayscale + autocontrast
+    for text, then JPEG re-encode stepping quality/size down until the payload
+    fits the byte budget.
+    """
+    max_bytes = max_bytes or IMAGE_MAX_BYTES
+
+    if isinstance(source, Image.Image):
+        image = source
+        # Raw RGB size as the baseline; encoding a full-size copy just to measure it costs too much
+        original_bytes = image.width * image.height * 3
+    else:
+        original_bytes = len(source)
+        try:
+            image = Image.open(io.BytesIO(source))
+            # Let JPEG decode at a reduced scale so full-size phone photos never hit memory
+            scale = IMAGE_MAX_EDGE / max(image.size)
+            if scale < 1:
+                image.draft("RGB", (int(image.width * scale), int(image.height * scale)))
+            image.load()
+        except Exception as e:
+            # Formats Pillow can't decode (e.g. HEIC without a plugin) go through untouched
+            print(f"Image prep skipped: {e}")
+            return base64.b64encode(source).decode('utf-8'), _stats(original_bytes, original_bytes, None)
+
+    image = ImageOps.exif_transpose(image)
+    if for_text:
+        image = ImageOps.autocontrast(ImageOps.grayscale(image), cutoff=1)
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    image = _fit_long_edge(image, IMAGE_MAX_EDGE)
+
+    quality = IMAGE_JPEG_QUALITY
+    data = _encode_jpeg(image, quality)
+    # Trade quality first, then resolution, until the payload fits the budget
+    while len(data) > max_bytes:
+        if quality > IMAGE_MIN_JPEG_QUALITY:
+            quality = max(IMAGE_MIN_JPEG_QUALITY, quality - 10)
+        elif max(image.size) > 512:
+            image = _fit_long_edge(image, int(max(image.size) * 0.8))
+        else:
+            break
+        data = _encode_jpeg(image, quality)
+
+    stats = _stats(original_bytes, len(data), image.size)
+    print(f"Image prep: {original_bytes} -> {len(data)} bytes "
+          f"({stats['saved_bytes']} saved, {image.size[0]}x{image.size[1]}, q={quality})")
+    return base64.b64encode(data).decode('utf-8'), stats
+
+
+def _fit_long_edge(image, max_edge):
+    if max(image.size) <= max_edge:
+        return image
+    scale = max_edge / max(image.size)
+    return image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+
+
+def _encode_jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _stats(original_bytes, final_bytes, size):
+    return {
+        "original_bytes": original_bytes,
+        "final_bytes": final_bytes,
+        "saved_bytes": max(0, original_bytes - final_bytes),
+        "size": size,
+    }
@@ -1,16 +1,13 @@
-import os 
-import base64
-from groq import Groq
-
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+from utils import llm
+from utils.image_prep import prepare_image
 
 
 def analyze_note_image(image_path):
     with open(image_path, "rb") as image_file:
-        encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
+        encoded_image, _ = prepare_image(image_file.read())
 
-    chat_completion = client.chat.completions.create(
-        messages=[
+    return llm.complete(
+        [
             {
                 "role": "user",
                 "content": [
@@ -22,7 +19,5 @@ def analyze_note_image(image_path):
                 ],
             }
         ],
-        model="llama-3.2-vision-preview",
+        model=llm.VISION_MODEL, kind="vision", cache=True,
     )
-
-    return chat_completion.choices[0].message.content
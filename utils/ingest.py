@@ -0,0 +1,204 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.text_extractor import iter_text_from_file, extract_images, is_image_file, OCR_BATCH_SIZE, \
+    LOW_MEMORY_FILE_BYTES
+
+# How many uploaded files are extracted at the same time
+INGEST_MAX_WORKERS = int(os.environ.get("INGEST_MAX_WORKERS", 4))
+# Memory-bounded mode: uploads are spooled to temp files and PDFs are memory-mapped
+INGEST_LOW_MEMORY = os.environ.get("INGEST_LOW_MEMORY", "0") == "1"
+# How far worker RSS may grow above its level at the start of a job (0 = only measure and report)
+INGEST_RSS_BUDGET_MB = int(os.environ.get("INGEST_RSS_BUDGET_MB", 0))
+
+
+class MemoryBudgetExceeded(MemoryError):
+    pass
+
+
+def current_rss_bytes():
+    """Resident memory of this worker process, or 0 where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+class RssMonitor:
+    """
+    Samples the worker's RSS in the background while a job runs and records the peak.
+    The budget applies to growth over the RSS at the start of the job, since freed memory
+    is rarely returned to the OS. RSS is per process, so concurrent jobs in the same worker
+    count against each other's budgets.
+    """
+
+    def __init__(self, budget_mb=None, interval=0.1):
+        self.budget_bytes = (INGEST_RSS_BUDGET_MB if budget_mb is None else budget_mb) * 1024 * 1024
+        self.interval = interval
+        self.baseline_bytes = self.peak_bytes = current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+
+    @property
+    def peak_mb(self):
+        return self.peak_bytes / (1024 * 1024)
+
+    @property
+    def growth_mb(self):
+        return max(0, self.peak_bytes - self.baseline_bytes) / (1024 * 1024)
+
+    def check(self):
+        """Raises MemoryBudgetExceeded once the job has grown past its RSS budget."""
+        self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+        if self.budget_bytes and self.peak_bytes - self.baseline_bytes > self.budget_bytes:
+            raise MemoryBudgetExceeded(
+                f"Memory grew by {self.growth_mb:.0f}MB, over the {self.budget_bytes // (1024 * 1024)}MB budget")
+
+
+def extract_files(files, max_workers=None, low_memory=None):
+    """
+    Extracts several uploads (Flask file objects or local paths) in a bounded pool.
+    Returns (combined_text, report): the text is joined in upload order and the
+    report holds one entry per file with its char count, timing, peak RSS and any error.
+    Photos of notes are OCR'd OCR_BATCH_SIZE at a time in shared vision requests.
+
+    low_memory (default INGEST_LOW_MEMORY, or per file once it reaches LOW_MEMORY_FILE_MB)
+    spools uploads to temp files first, memory-maps PDFs, renders one page at a time
+    and enforces INGEST_RSS_BUDGET_MB.
+    """
+    files = [f for f in files if f and _filename(f)]
+    if not files:
+        return "", []
+
+    images = [k for k, f in enumerate(files) if is_image_file(_filename(f))]
+    jobs = [[k] for k, f in enumerate(files) if k not in set(images)]
+    jobs += [images[i:i + OCR_BATCH_SIZE] for i in range(0, len(images), OCR_BATCH_SIZE)]
+    jobs.sort()
+
+    def run(job):
+        if is_image_file(_filename(files[job[0]])):
+            return _extract_images([files[k] for k in job])
+        return [_extract_one(files[job[0]], low_memory)]
+
+    results = [None] * len(files)
+    workers = max(1, min(max_workers or INGEST_MAX_WORKERS, len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for job, job_results in zip(jobs, pool.map(run, jobs)):
+            for k, result in zip(job, job_results):
+                results[k] = result
+
+    combined_text = "\n".join(text for text, _ in results if text.strip())
+    if combined_text:
+        combined_text += "\n"
+    report = [entry for _, entry in results]
+    for entry in report:
+        if entry["error"]:
+            print(f"❌ Extraction error for {entry['filename']}: {entry['error']}")
+        elif entry["chars"]:
+            print(f"✅ Extracted {entry['chars']} chars from {entry['filename']} "
+                  f"in {entry['seconds']:.1f}s (peak RSS {entry['peak_rss_mb']:.0f}MB, +{entry['rss_growth_mb']:.0f}MB)")
+        else:
+            print(f"⚠️ Extraction returned no text for {entry['filename']}")
+    return combined_text, report
+
+
+def spool_to_temp_file(file_obj):
+    """Streams a Flask upload to a temp file in blocks and returns its path."""
+    suffix = os.path.splitext(file_obj.filename)[1].lower()
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, 'wb') as out:
+        file_obj.seek(0)
+        for block in iter(lambda: file_obj.read(1024 * 1024), b""):
+            out.write(block)
+    return path
+
+
+def _extract_one(file_obj_or_path, low_memory=None):
+    filename = _filename(file_obj_or_path)
+    if low_memory is None:
+        low_memory = INGEST_LOW_MEMORY or _file_size(file_obj_or_path) >= LOW_MEMORY_FILE_BYTES
+    started = time.perf_counter()
+    pages, error = [], None
+    temp_path = None
+    with RssMonitor(budget_mb=None if low_memory else 0) as monitor:
+        try:
+            source = file_obj_or_path
+            if low_memory and not isinstance(source, str):
+                source = temp_path = spool_to_temp_file(file_obj_or_path)
+            for _, text in iter_text_from_file(source, low_memory=low_memory):
+                pages.append(text)
+                monitor.check()
+        except Exception as e:
+            # A failed or over-budget file contributes nothing rather than a partial read
+            pages, error = [], str(e)
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+    text = "".join(pages)
+    entry = {
+        "filename": filename,
+        "chars": len(text.strip()),
+        "seconds": time.perf_counter() - started,
+        "peak_rss_mb": monitor.peak_mb,
+        "rss_growth_mb": monitor.growth_mb,
+        "error": error,
+    }
+    return text, entry
+
+
+def _extract_images(image_files):
+    """OCRs a batch of images in one vision request; returns (text, report entry) per image."""
+    started = time.perf_counter()
+    with RssMonitor(budget_mb=0) as monitor:
+        try:
+            texts, error = extract_images(image_files), None
+        except Exception as e:
+            texts, error = [""] * len(image_files), str(e)
+    seconds = time.perf_counter() - started
+    return [(text, {
+        "filename": _filename(image_file),
+        "chars": len(text.strip()),
+        "seconds": seconds,
+        "peak_rss_mb": monitor.peak_mb,
+        "rss_growth_mb": monitor.growth_mb,
+        "error": error,
+    }) for image_file, text in zip(image_files, texts)]
+
+
+def _file_size(file_obj_or_path):
+    """Size of a path or upload; uploads are measured on their spooled stream, which is cheap."""
+    if isinstance(file_obj_or_path, str):
+        return os.path.getsize(file_obj_or_path)
+    if file_obj_or_path.content_length:
+        return file_obj_or_path.content_length
+    try:
+        stream = file_obj_or_path.stream
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def _filename(file_obj_or_path):
+    if isinstance(file_obj_or_path, str):
+        return os.path.basename(file_obj_or_path)
+    return file_obj_or_path.filename
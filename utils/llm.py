@@ -0,0 +1,371 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FutureTimeout, wait
+import httpx
+import groq
+from groq import Groq
+from utils.cache import DiskCache
+from utils.chunker import estimate_tokens
+from utils.rate_limit import RateLimiter, RateLimitTimeout, parse_limits, INTERACTIVE, NORMAL, BACKGROUND
+from utils.routing import LatencyTracker, Router, parse_policies
+from utils.circuit_breaker import CircuitBreakers, CircuitOpen
+from utils.single_flight import SingleFlight
+
+# Model names used across the app
+SMART_MODEL = os.environ.get("LLM_SMART_MODEL", "llama-3.3-70b-versatile")
+FAST_MODEL = os.environ.get("LLM_FAST_MODEL", "llama-3.1-8b-instant")
+VISION_MODEL = os.environ.get("LLM_VISION_MODEL", "llama-3.2-11b-vision-preview")
+WHISPER_MODEL = os.environ.get("LLM_WHISPER_MODEL", "whisper-large-v3-turbo")
+
+# Read timeouts per call type, in seconds
+TIMEOUTS = {
+    "chat": float(os.environ.get("LLM_TIMEOUT_CHAT", 60)),
+    "fast": float(os.environ.get("LLM_TIMEOUT_FAST", 30)),
+    "stream": float(os.environ.get("LLM_TIMEOUT_STREAM", 120)),
+    "vision": float(os.environ.get("LLM_TIMEOUT_VISION", 90)),
+    "audio": float(os.environ.get("LLM_TIMEOUT_AUDIO", 180)),
+}
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 10))
+# One keep-alive pool per worker process, shared by every thread
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 32))
+LLM_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_KEEPALIVE_CONNECTIONS", 16))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+
+# Requests/tokens per minute per model, shared by all workers ("model=rpm/tpm,..."; tpm 0 = requests only)
+LLM_RATE_LIMITS = os.environ.get("LLM_RATE_LIMITS") or (
+    f"{SMART_MODEL}=30/12000,{FAST_MODEL}=30/20000,{VISION_MODEL}=30/7000,{WHISPER_MODEL}=20/0")
+# Used when a 429 carries no retry-after header
+LLM_DEFAULT_RETRY_AFTER = float(os.environ.get("LLM_DEFAULT_RETRY_AFTER", 10))
+# Rough budget charged up front for a reply (refunded or topped up from the usage report)
+LLM_REPLY_TOKEN_ESTIMATE = 500
+IMAGE_TOKEN_ESTIMATE = 1000
+limiter = RateLimiter(parse_limits(LLM_RATE_LIMITS))
+# Identical requests already in flight in this worker are shared instead of sent twice
+flights = SingleFlight()
+
+# Routing policy per latency-sensitive endpoint (override with LLM_ROUTING='{"ask_tutor": {"slo_p95": 3}}').
+# For streams the SLO applies to the time until the reply starts, for completions to the whole call.
+ROUTING_POLICIES = {
+    "ask_tutor": {"model": SMART_MODEL, "fallback": FAST_MODEL, "slo_p95": 4.0, "hedge_after": 3.0},
+    "chat_professor": {"model": SMART_MODEL, "fallback": FAST_MODEL, "slo_p95": 10.0},
+    "quiz_feedback": {"model": SMART_MODEL, "fallback": FAST_MODEL, "slo_p95": 8.0},
+}
+LLM_HEDGE_WORKERS = int(os.environ.get("LLM_HEDGE_WORKERS", 8))
+latency = LatencyTracker()
+# Fail fast per model and API endpoint ("model/chat", "model/stream", "model/audio") during outages
+breakers = CircuitBreakers()
+router = Router(parse_policies(ROUTING_POLICIES, os.environ.get("LLM_ROUTING")), latency,
+                available=lambda model, series: not breakers.is_open(f"{model}/{series}"))
+_hedge_pool = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS)
+
+# Response cache for deterministic calls; callers opt in with cache=True (or opt out with cache=False)
+LLM_CACHE_DEFAULT = os.environ.get("LLM_CACHE_DEFAULT", "0") == "1"
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL_HOURS", 24 * 7)) * 3600
+LLM_CACHE_REPORT_EVERY = int(os.environ.get("LLM_CACHE_REPORT_EVERY", 100))
+response_cache = DiskCache("llm", int(os.environ.get("LLM_CACHE_MAX_MB", 128)) * 1024 * 1024, ttl=LLM_CACHE_TTL)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+_cache_stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0, "saved_tokens": 0}
+_cache_stats_lock = threading.Lock()
+
+
+def timeout_for(kind):
+    return httpx.Timeout(TIMEOUTS.get(kind, TIMEOUTS["chat"]), connect=LLM_CONNECT_TIMEOUT)
+
+
+def get_client():
+    """
+    The worker's shared Groq client. Created per process so forked workers never share sockets.
+    There is deliberately no async client: every caller runs in a sync Flask or worker thread,
+    and concurrent calls (hedges, summaries, transcription parts) share this pool from threads.
+    """
+    key = ("sync", os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                # Retries go through send() so they respect the shared rate limits
+                client = _clients[key] = Groq(
+                    api_key=os.environ.get("GROQ_API_KEY"),
+                    max_retries=0,
+                    http_client=httpx.Client(limits=_limits(), timeout=timeout_for("chat")),
+                )
+    return client
+
+
+def complete(messages, model=SMART_MODEL, kind="chat", cache=None, ttl=None, priority=NORMAL, coalesce=True,
+             route=None, **kwargs):
+    """
+    Runs a chat completion and returns the reply text.
+    With cache=True an identical earlier request (same model, messages and parameters)
+    is answered from the response cache; ttl overrides LLM_CACHE_TTL for this call.
+    priority orders this call against others queued for the same model, and with
+    coalesce an identical call already running in this worker is joined instead of repeated.
+    route names an entry of ROUTING_POLICIES, which then picks the model.
+    """
+    hedge_model, hedge_after = None, None
+    if route:
+        model, hedge_model, hedge_after = router.choose(route, model, "chat")
+    key = cache_key(model, messages, kwargs)
+    use_cache = LLM_CACHE_DEFAULT if cache is None else cache
+    if use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            entry = json.loads(cached)
+            _count_cache(hit=True, seconds=entry["seconds"], tokens=entry["tokens"])
+            return entry["text"]
+        _count_cache(hit=False)
+
+    def request(model=model):
+        started = time.perf_counter()
+        tokens = estimate_request_tokens(messages, kwargs)
+        response = send(model, tokens, priority, lambda: get_client().chat.completions.create(
+            model=model, messages=messages, timeout=timeout_for(kind), **kwargs), series="chat", route=route)
+        text = response.choices[0].message.content
+        usage = getattr(response, "usage", None)
+        if getattr(usage, "total_tokens", None):
+            limiter.settle(model, usage.total_tokens - tokens)
+        if use_cache and text:
+            response_cache.set(cache_key(model, messages, kwargs), json.dumps({
+                "text": text,
+                "seconds": time.perf_counter() - started,
+                "tokens": getattr(usage, "total_tokens", 0) or 0,
+            }), ttl=ttl)
+        return text
+
+    run = request
+    if hedge_model and hedge_after:
+        run = lambda: hedged(route, request, lambda: request(hedge_model), hedge_after)
+    return flights.do(key, run) if coalesce else run()
+
+
+def stream(messages, model=SMART_MODEL, kind="stream", priority=INTERACTIVE, coalesce=True, route=None, **kwargs):
+    """
+    Yields the reply of a streamed chat completion piece by piece as it arrives.
+    With coalesce, identical streams running at the same time in this worker share one
+    upstream call and every reader gets the whole reply. route works as in complete().
+    """
+    hedge_model, hedge_after = None, None
+    if route:
+        model, hedge_model, hedge_after = router.choose(route, model, "stream")
+
+    def request(model=model):
+        response = send(model, estimate_request_tokens(messages, kwargs), priority,
+                        lambda: get_client().chat.completions.create(
+                            model=model, messages=messages, stream=True, timeout=timeout_for(kind), **kwargs),
+                        series="stream", route=route)
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+
+    run = request
+    if hedge_model and hedge_after:
+        run = lambda: hedged_stream(route, request, lambda: request(hedge_model), hedge_after)
+    if coalesce:
+        yield from flights.stream("stream:" + cache_key(model, messages, kwargs), run)
+    else:
+        yield from run()
+
+
+def transcribe(file, model=WHISPER_MODEL, priority=NORMAL, **kwargs):
+    """Whisper transcription of an audio file tuple (name, fileobj); returns the API response."""
+    def request():
+        file[1].seek(0)  # A retried upload must resend the whole file
+        return get_client().audio.transcriptions.create(
+            file=file, model=model, timeout=timeout_for("audio"), **kwargs)
+    return send(model, 0, priority, request, series="audio")
+
+
+def send(model, tokens, priority, request, series="chat", route=None):
+    """
+    Runs request() once the model's shared budget allows it. A 429 pauses the model for
+    every worker for the provider's retry-after and puts the call back in the queue;
+    connection resets and 5xx responses are retried with a short backoff, timeouts are not.
+    Each call's latency and outcome feed the model's routing stats under the route
+    (or series, for unrouted calls), so an endpoint's SLO only sees its own calls. The
+    model/series circuit breaker counts one failure per failed call: while it is open,
+    CircuitOpen is raised.
+    """
+    circuit = f"{model}/{series}"
+    samples = route or series
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        breakers.allow(circuit)
+        limiter.acquire(model, tokens, priority)
+        started = time.perf_counter()
+        try:
+            response = request()
+            latency.record(model, samples, time.perf_counter() - started)
+            breakers.success(circuit)
+            return response
+        except groq.RateLimitError as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            limiter.penalize(model, retry_after(e))
+        except groq.APITimeoutError as e:
+            # Another attempt would only wait out the full timeout again; let the caller's fallback take over
+            latency.record(model, samples, time.perf_counter() - started, ok=False)
+            breakers.failure(circuit, e)
+            raise
+        except (groq.APIConnectionError, groq.InternalServerError) as e:
+            if attempt == LLM_MAX_RETRIES:
+                latency.record(model, samples, time.perf_counter() - started, ok=False)
+                breakers.failure(circuit, e)
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
+
+def hedged(route, primary, backup, after):
+    """
+    Returns primary(), but if it hasn't finished after `after` seconds also starts backup()
+    and returns whichever succeeds first. The slower call is left to finish in the background.
+    """
+    first = _hedge_pool.submit(primary)
+    try:
+        return first.result(timeout=after)
+    except FutureTimeout:
+        pass
+    except Exception:
+        pass  # Failed early: the backup gets its chance straight away
+    second = _hedge_pool.submit(backup)
+    pending, error = {first, second}, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                router.count_hedge(route, won=future is second)
+                return future.result()
+            error = future.exception()
+    router.count_hedge(route, won=False)
+    raise error
+
+
+def hedged_stream(route, primary, backup, after):
+    """
+    Streaming version of hedged(): backup() starts if primary() hasn't produced its first
+    piece after `after` seconds (or failed before it), and the first stream to produce
+    a piece is the one yielded. The other is closed.
+    """
+    events = queue.Queue()
+    state = {"winner": None, "closed": False}
+
+    def pump(source, start):
+        try:
+            for piece in start():
+                if state["closed"] or state["winner"] not in (None, source):
+                    return
+                events.put((source, piece, None))
+            events.put((source, None, None))
+        except Exception as e:
+            events.put((source, None, e))
+
+    threading.Thread(target=pump, args=("primary", primary), daemon=True).start()
+    running, hedging = 1, False
+    deadline = time.monotonic() + after
+    try:
+        while True:
+            try:
+                timeout = None if hedging or state["winner"] else max(0.0, deadline - time.monotonic())
+                source, piece, error = events.get(timeout=timeout)
+            except queue.Empty:
+                source, piece, error = None, None, None
+            if source is None or (error is not None and state["winner"] is None and not hedging):
+                # Primary is slow to start or failed before its first piece: start the backup
+                hedging = True
+                running += 1
+                threading.Thread(target=pump, args=("backup", backup), daemon=True).start()
+                if source is None:
+                    continue
+            if state["winner"] not in (None, source):
+                continue
+            if piece is not None:
+                if state["winner"] is None:
+                    state["winner"] = source
+                    if hedging:
+                        router.count_hedge(route, won=source == "backup")
+                yield piece
+                continue
+            running -= 1
+            if error is None or state["winner"] == source or not running:
+                if error is not None:
+                    raise error
+                return
+    finally:
+        state["closed"] = True
+
+
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return LLM_DEFAULT_RETRY_AFTER
+
+
+def estimate_request_tokens(messages, params):
+    tokens = params.get("max_tokens") or LLM_REPLY_TOKEN_ESTIMATE
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+            continue
+        for part in content or []:
+            tokens += estimate_tokens(part.get("text", "")) if part.get("type") == "text" else IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+
+def cache_key(model, messages, params):
+    payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, default=str)
+    return f"{model}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def status():
+    """Breakers, routing and cache state of this worker, for the admin panel."""
+    return {
+        "breakers": breakers.states(),
+        "routes": router.state(),
+        "latency": latency.snapshot(),
+        "cache": cache_stats(),
+        "coalesced": flights.coalesced,
+    }
+
+
+def cache_stats():
+    """Response cache hits and misses in this worker, with the upstream time and tokens the hits saved."""
+    with _cache_stats_lock:
+        stats = dict(_cache_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+def _count_cache(hit, seconds=0.0, tokens=0):
+    with _cache_stats_lock:
+        if hit:
+            _cache_stats["hits"] += 1
+            _cache_stats["saved_seconds"] += seconds
+            _cache_stats["saved_tokens"] += tokens
+        else:
+            _cache_stats["misses"] += 1
+        lookups = _cache_stats["hits"] + _cache_stats["misses"]
+    if lookups % LLM_CACHE_REPORT_EVERY == 0:
+        stats = cache_stats()
+        print(f"LLM cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%}), "
+              f"saved {stats['saved_seconds']:.0f}s and {stats['saved_tokens']} tokens")
+
+
+def _limits():
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=60)
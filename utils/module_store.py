@@ -0,0 +1,28 @@
+from app.models import db, ModuleContent
+
+
+def load_module_content(lecture_id, module_index, module_title, prompt_version):
+    """Returns the stored body of a classroom module, or None if it was never generated for this syllabus/prompt."""
+    row = ModuleContent.query.filter_by(lecture_id=lecture_id, module_index=module_index,
+                                        prompt_version=prompt_version).first()
+    if row and row.module_title == (module_title or "")[:255]:
+        return row.content
+    return None
+
+
+def save_module_content(lecture_id, module_index, module_title, prompt_version, content):
+    """Stores a generated module body, replacing one left over from an older syllabus."""
+    if not content:
+        return
+    try:
+        row = ModuleContent.query.filter_by(lecture_id=lecture_id, module_index=module_index,
+                                            prompt_version=prompt_version).first()
+        if not row:
+            row = ModuleContent(lecture_id=lecture_id, module_index=module_index, prompt_version=prompt_version)
+            db.session.add(row)
+        row.module_title = (module_title or "")[:255]
+        row.content = content
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Module content save failed: {e}")
@@ -0,0 +1,152 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from utils.cache import SharedSqlite
+
+# Request priorities: lower numbers are served first when a model is at its limit
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+
+# How long a call may wait in the queue before giving up
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", 120))
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def parse_limits(spec):
+    """Parses "model=rpm/tpm,..." (tpm 0 = no token budget) into {model: (rpm, tpm)}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        model, _, budget = item.partition("=")
+        rpm, _, tpm = budget.partition("/")
+        limits[model.strip()] = (float(rpm), float(tpm or 0))
+    return limits
+
+
+class RateLimiter:
+    """
+    Token buckets for requests and tokens per minute, one pair per model.
+    Bucket levels and retry-after pauses live in SQLite, so every gunicorn worker draws
+    from the same budget. Inside a worker, callers queue per model by priority and wait
+    on a condition until the head of the queue has been granted.
+    """
+
+    def __init__(self, limits, name="rate_limits"):
+        self._db = SharedSqlite(name, autocommit=True)
+        self.limits = limits
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._order = itertools.count()
+        with self._db.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    model TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0
+                )""")
+
+    def acquire(self, model, tokens=0, priority=NORMAL, timeout=None):
+        """Blocks until the model's budget covers one request of about `tokens` tokens."""
+        if model not in self.limits:
+            return
+        deadline = time.monotonic() + (LLM_QUEUE_TIMEOUT if timeout is None else timeout)
+        ticket = (priority, next(self._order))
+        with self._cond:
+            queue = self._queues.setdefault(model, [])
+            heapq.heappush(queue, ticket)
+        try:
+            while True:
+                with self._cond:
+                    while queue[0] != ticket:
+                        if not self._cond.wait(deadline - time.monotonic()):
+                            raise RateLimitTimeout(f"Timed out waiting for a {model} slot")
+                wait = self._try_take(model, tokens)
+                if wait <= 0:
+                    return
+                remaining = deadline - time.monotonic()
+                if wait > remaining:
+                    raise RateLimitTimeout(f"{model} is rate limited for another {wait:.0f}s")
+                with self._cond:
+                    self._cond.wait(wait)
+        finally:
+            with self._cond:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+                self._cond.notify_all()
+
+    def penalize(self, model, retry_after):
+        """Pauses a model for every worker after the provider answered 429 with retry-after."""
+        if model not in self.limits:
+            return
+        conn = self._db.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._load(conn, model, time.time())
+            conn.execute("UPDATE buckets SET blocked_until = MAX(blocked_until, ?), requests = 0 WHERE model = ?",
+                         (time.time() + retry_after, model))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def settle(self, model, tokens):
+        """Charges (or refunds, if negative) the difference between estimated and actual token usage."""
+        if model not in self.limits or not self.limits[model][1] or not tokens:
+            return
+        conn = self._db.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._load(conn, model, time.time())
+            conn.execute("UPDATE buckets SET tokens = MIN(tokens - ?, ?) WHERE model = ?",
+                         (tokens, self.limits[model][1], model))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _try_take(self, model, tokens):
+        """Takes one request and `tokens` from the buckets; returns 0, or the seconds until that is possible."""
+        rpm, tpm = self.limits[model]
+        tokens = min(tokens, tpm) if tpm else 0
+        now = time.time()
+        conn = self._db.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            requests, available, blocked_until = self._load(conn, model, now)
+            wait = max(0.0, blocked_until - now)
+            if requests < 1:
+                wait = max(wait, (1 - requests) * 60 / rpm)
+            if tpm and available < tokens:
+                wait = max(wait, (tokens - available) * 60 / tpm)
+            if wait <= 0:
+                conn.execute("UPDATE buckets SET requests = ?, tokens = ?, updated = ? WHERE model = ?",
+                             (requests - 1, available - tokens, now, model))
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _load(self, conn, model, now):
+        """Current (requests, tokens, blocked_until) for a model after refilling since the last update."""
+        rpm, tpm = self.limits[model]
+        row = conn.execute("SELECT requests, tokens, updated, blocked_until FROM buckets WHERE model = ?",
+                           (model,)).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO buckets (model, requests, tokens, updated) VALUES (?, ?, ?, ?)",
+                         (model, rpm, tpm, now))
+            return rpm, tpm, 0.0
+        requests, tokens, updated, blocked_until = row
+        elapsed = max(0.0, now - updated)
+        requests = min(rpm, requests + elapsed * rpm / 60)
+        tokens = min(tpm, tokens + elapsed * tpm / 60)
+        conn.execute("UPDATE buckets SET requests = ?, tokens = ?, updated = ? WHERE model = ?",
+                     (requests, tokens, now, model))
+        return requests, tokens, blocked_until
@@ -0,0 +1,149 @@
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from app.models import db, LectureIndex, text_hash
+from utils.chunker import chunk_text, clip_to_tokens, estimate_tokens
+
+# Retrieval chunk size; small chunks let top-k pick the passages that actually match
+RETRIEVAL_CHUNK_TOKENS = int(os.environ.get("RETRIEVAL_CHUNK_TOKENS", 400))
+RETRIEVAL_OVERLAP_TOKENS = 40
+# Bump when tokenization or chunking changes so stored indexes are rebuilt
+INDEX_VERSION = 1
+# Decoded indexes kept in memory per worker
+INDEX_MEMORY_SLOTS = int(os.environ.get("INDEX_MEMORY_SLOTS", 32))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this "
+    "to was were will with which what how why when who into than then there these those".split())
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def tokenize(text):
+    return [word for word in _WORD.findall((text or "").lower()) if word not in _STOPWORDS and len(word) > 1]
+
+
+def build_index(text):
+    """
+    Builds a BM25 inverted index over retrieval-sized chunks of text.
+    Chunks are stored as (start, end) offsets into the text, postings as {term: [[chunk, tf], ...]}.
+    """
+    chunks = chunk_text(text or "", RETRIEVAL_CHUNK_TOKENS, overlap_tokens=RETRIEVAL_OVERLAP_TOKENS)
+    postings = {}
+    lengths = []
+    for idx, chunk in enumerate(chunks):
+        terms = tokenize(chunk.text)
+        lengths.append(len(terms))
+        for term, tf in Counter(terms).items():
+            postings.setdefault(term, []).append([idx, tf])
+    return {
+        "version": INDEX_VERSION,
+        "spans": [[chunk.start, chunk.end] for chunk in chunks],
+        "lengths": lengths,
+        "avg_length": (sum(lengths) / len(lengths)) if lengths else 0,
+        "postings": postings,
+    }
+
+
+def search(index, query, k=5):
+    """Returns up to k (chunk_index, score) pairs, best first. Only the query terms' postings are read."""
+    if not index or not index["lengths"]:
+        return []
+    n = len(index["lengths"])
+    avg_length = index["avg_length"] or 1
+    scores = Counter()
+    for term in set(tokenize(query)):
+        postings = index["postings"].get(term)
+        if not postings:
+            continue
+        idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+        for idx, tf in postings:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * index["lengths"][idx] / avg_length)
+            scores[idx] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores.most_common(k)
+
+
+def save_lecture_index(lecture_id, text):
+    """Builds and stores the lecture's index; called once at ingest. Returns the index."""
+    index = build_index(text)
+    digest = text_hash(text)
+    try:
+        row = LectureIndex.query.filter_by(lecture_id=lecture_id).first()
+        if not row:
+            row = LectureIndex(lecture_id=lecture_id)
+            db.session.add(row)
+        row.text_hash = digest
+        row.version = INDEX_VERSION
+        row.data = zlib.compress(json.dumps(index, separators=(",", ":")).encode("utf-8"))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Lecture index save failed: {e}")
+    _remember(lecture_id, digest, index)
+    return index
+
+
+def load_lecture_index(lecture_id, text, digest=None):
+    """
+    Returns the stored index for a lecture, building it if the lecture predates indexing
+    or its transcript changed. Decoded indexes are kept in a small per-worker LRU.
+    Pass the lecture's stored transcript_hash as digest to skip hashing the text.
+    """
+    digest = digest or text_hash(text)
+    with _memory_lock:
+        cached = _memory.get(lecture_id)
+        if cached and cached[0] == digest:
+            _memory.move_to_end(lecture_id)
+            return cached[1]
+
+    row = LectureIndex.query.filter_by(lecture_id=lecture_id).first()
+    if row and row.text_hash == digest and row.version == INDEX_VERSION:
+        index = json.loads(zlib.decompress(row.data).decode("utf-8"))
+        _remember(lecture_id, digest, index)
+        return index
+    return save_lecture_index(lecture_id, text)
+
+
+def retrieve_context(lecture, query, max_tokens=3750, k=8):
+    """
+    The lecture passages that best match query, in document order, within max_tokens.
+    Falls back to the opening of the lecture when nothing matches.
+    """
+    text = lecture.transcript or ""
+    index = load_lecture_index(lecture.id, text, lecture.transcript_hash)
+    passages, used = [], 0
+    for idx, _ in search(index, query, k):
+        start, end = index["spans"][idx]
+        cost = estimate_tokens(text[start:end])
+        if used + cost > max_tokens:
+            continue
+        passages.append((start, end))
+        used += cost
+    if not passages:
+        return clip_to_tokens(text, max_tokens)
+
+    # Neighbouring chunks overlap, so merge their spans instead of repeating the shared text
+    merged = []
+    for start, end in sorted(passages):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return "\n\n[...]\n\n".join(text[start:end].strip() for start, end in merged)
+
+
+def _remember(lecture_id, digest, index):
+    with _memory_lock:
+        _memory[lecture_id] = (digest, index)
+        _memory.move_to_end(lecture_id)
+        while len(_memory) > INDEX_MEMORY_SLOTS:
+            _memory.popitem(last=False)
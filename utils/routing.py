@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Latency samples kept per model and endpoint; older ones age out so a recovered model is tried again
+ROUTE_WINDOW = int(os.environ.get("LLM_ROUTE_WINDOW", 50))
+ROUTE_WINDOW_SECONDS = float(os.environ.get("LLM_ROUTE_WINDOW_SECONDS", 300))
+# Below this many recent samples a model is assumed healthy
+ROUTE_MIN_SAMPLES = int(os.environ.get("LLM_ROUTE_MIN_SAMPLES", 5))
+
+DEFAULT_POLICY = {
+    "model": None,          # preferred model
+    "fallback": None,       # faster model used while the preferred one breaches its SLO
+    "slo_p95": None,        # seconds; p95 latency above this breaches the SLO
+    "max_error_rate": 0.5,  # share of failed calls above this breaches the SLO
+    "hedge_after": None,    # seconds; send a second request to the fallback if the first is still waiting
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LatencyTracker:
+    """Rolling latency and error samples per (model, series) within a worker; series is a route or call type."""
+
+    def __init__(self, window=ROUTE_WINDOW, max_age=ROUTE_WINDOW_SECONDS):
+        self.window = window
+        self.max_age = max_age
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, series, seconds, ok=True):
+        with self._lock:
+            samples = self._samples.setdefault((model, series), deque(maxlen=self.window))
+            samples.append((time.monotonic(), seconds, ok))
+
+    def stats(self, model, series):
+        """Recent p50/p95 latency (successful calls) and error rate for a model."""
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            samples = [s for s in self._samples.get((model, series), ()) if s[0] >= cutoff]
+        latencies = [seconds for _, seconds, ok in samples if ok]
+        return {
+            "samples": len(samples),
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "error_rate": (len(samples) - len(latencies)) / len(samples) if samples else 0.0,
+        }
+
+    def snapshot(self):
+        with self._lock:
+            keys = list(self._samples)
+        return {f"{model} ({series})": self.stats(model, series) for model, series in keys}
+
+
+class Router:
+    """
+    Picks the model for a named endpoint from its policy. While the preferred model breaches
+    the endpoint's latency SLO or error budget, or isn't available, calls go to the fallback model instead.
+    """
+
+    def __init__(self, policies, tracker, available=None):
+        self.policies = {route: dict(DEFAULT_POLICY, **policy) for route, policy in policies.items()}
+        self.tracker = tracker
+        self.available = available or (lambda model, series: True)
+        self._degraded = set()
+        self._lock = threading.Lock()
+        self.hedges = {}
+
+    def policy(self, route):
+        return self.policies.get(route) or DEFAULT_POLICY
+
+    def healthy(self, model, route, series, policy):
+        if not self.available(model, series):
+            return False
+        # Only this endpoint's own calls count, so slow batch work on the same model can't breach its SLO
+        stats = self.tracker.stats(model, route)
+        if stats["samples"] < ROUTE_MIN_SAMPLES:
+            return True
+        if policy["slo_p95"] and stats["p95"] is not None and stats["p95"] > policy["slo_p95"]:
+            return False
+        return stats["error_rate"] <= policy["max_error_rate"]
+
+    def choose(self, route, model, series):
+        """Returns (model, hedge_model, hedge_after) for a call to route; hedge_model is None when not hedging."""
+        policy = self.policy(route)
+        preferred, fallback = policy["model"] or model, policy["fallback"]
+        if not fallback or fallback == preferred:
+            return preferred, None, None
+        healthy = self.healthy(preferred, route, series, policy)
+        with self._lock:
+            if healthy == (route in self._degraded):
+                print(f"LLM route {route}: {'back to ' + preferred if healthy else 'falling back to ' + fallback} "
+                      f"({self.tracker.stats(preferred, route)})")
+                (self._degraded.discard if healthy else self._degraded.add)(route)
+        if not healthy:
+            return fallback, None, None
+        return preferred, fallback, policy["hedge_after"]
+
+    def count_hedge(self, route, won):
+        with self._lock:
+            counts = self.hedges.setdefault(route, {"sent": 0, "won": 0})
+            counts["sent"] += 1
+            counts["won"] += int(won)
+
+    def state(self):
+        with self._lock:
+            degraded, hedges = set(self._degraded), {route: dict(c) for route, c in self.hedges.items()}
+        return {route: {"degraded": route in degraded, "hedges": hedges.get(route, {"sent": 0, "won": 0}),
+                        **policy} for route, policy in self.policies.items()}
+
+
+def parse_policies(defaults, spec):
+    """Merges a JSON override such as '{"ask_tutor": {"slo_p95": 3}}' into the default policies."""
+    policies = {route: dict(policy) for route, policy in defaults.items()}
+    if spec:
+        try:
+            for route, policy in json.loads(spec).items():
+                policies.setdefault(route, {}).update(policy)
+        except (ValueError, AttributeError) as e:
+            print(f"Ignoring invalid LLM_ROUTING: {e}")
+    return policies
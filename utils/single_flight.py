@@ -0,0 +1,97 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Stream:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.items = []
+        self.finished = False
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls within a worker into one upstream call.
+    Callers that arrive while a call with the same key is running wait for it and share its result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Returns fn(), or the result of the identical call already in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stream(self, key, fn):
+        """
+        Yields the items of fn() (an iterable). Identical concurrent callers share one upstream
+        iteration run by a background thread, and each of them sees every item from the start,
+        so one reader disconnecting never cuts the stream short for the others.
+        """
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight is None:
+                flight = self._streams[key] = _Stream()
+                threading.Thread(target=self._pump, args=(key, flight, fn), daemon=True).start()
+            else:
+                self.coalesced += 1
+        seen = 0
+        while True:
+            with flight.cond:
+                while seen >= len(flight.items) and not flight.finished:
+                    flight.cond.wait()
+                items = flight.items[seen:]
+                finished, error = flight.finished, flight.error
+            seen += len(items)
+            yield from items
+            if finished and seen >= len(flight.items):
+                if error is not None:
+                    raise error
+                return
+
+    def _pump(self, key, flight, fn):
+        try:
+            for item in fn():
+                with flight.cond:
+                    flight.items.append(item)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            # Callers arriving from now on start a fresh upstream call
+            with self._lock:
+                self._streams.pop(key, None)
+            with flight.cond:
+                flight.finished = True
+                flight.cond.notify_all()
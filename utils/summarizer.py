@@ -1,13 +1,39 @@
 import os
+import hashlib
 import logging
-from groq import Groq
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from utils import llm
+from utils.chunker import chunk_text, chunk_bounds, clip_to_tokens, estimate_tokens, CHARS_PER_TOKEN
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Map-phase chunk size and overlap, in approximate tokens
+MAP_CHUNK_TOKENS = int(os.getenv('MAP_CHUNK_TOKENS', 4000))
+MAP_OVERLAP_TOKENS = int(os.getenv('MAP_OVERLAP_TOKENS', 100))
+# How many chunk summaries run at the same time during the map phase
+MAP_MAX_WORKERS = int(os.getenv('MAP_MAX_WORKERS', 4))
+# Summaries merged per reduce call, and how much context the final synthesis model is given
+REDUCE_FAN_IN = max(2, int(os.getenv('REDUCE_FAN_IN', 5)))
+FINAL_CONTEXT_TOKENS = int(os.getenv('FINAL_CONTEXT_TOKENS', 10000))
+
+# Bump when the map prompt or model changes so stored chunk summaries stop matching
+MAP_PROMPT_VERSION = "1"
+
+def chunk_hash(chunk):
+    return hashlib.sha256(f"{MAP_PROMPT_VERSION}:{chunk}".encode('utf-8')).hexdigest()
+
+def _done_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+class MapProgress(str):
+    """Status line yielded by get_study_notes(progress=True) while chunks are summarized; not part of the notes."""
+
 class StudyAI:
     def __init__(self):
         self.api_key = os.getenv('GROQ_API_KEY')
@@ -15,35 +41,152 @@ class StudyAI:
             logger.error("GROQ_API_KEY not found in environment variables!")
             raise ValueError("Missing API Configuration")
         
-        self.client = Groq(api_key=self.api_key)
-        self.model = "llama-3.3-70b-versatile"
+        self.model = llm.SMART_MODEL
+
+    def split_chunks(self, transcript):
+        return [chunk.text for chunk in chunk_text(transcript, MAP_CHUNK_TOKENS, MAP_OVERLAP_TOKENS)]
+
+    def summarize_chunk(self, idx, chunk):
+        prompt = f"Summarize this part of the lecture in detail for notes. Part {idx+1}:\n\n{chunk}"
+        return llm.complete([{"role": "user", "content": prompt}], model=llm.FAST_MODEL, cache=True)
+
+    def reduce_summaries(self, idx, summaries):
+        joined = "\n\n".join(summaries)
+        prompt = (
+            "Merge these consecutive section summaries of one lecture into a single detailed summary. "
+            f"Keep every key concept, definition and example, in their original order. Group {idx+1}:\n\n{joined}"
+        )
+        return llm.complete([{"role": "user", "content": prompt}], model=llm.FAST_MODEL, cache=True)
+
+    def _run_parallel(self, fn, items, label, prefetched=None):
+        """
+        Runs fn(idx, item) for every item, MAP_MAX_WORKERS at a time.
+        Yields a MapProgress line as each one finishes, then the results in item order (None for failures).
+        Raises llm.CircuitOpen as soon as an item is refused by an open circuit breaker.
+        """
+        prefetched = prefetched or {}
+        pool = ThreadPoolExecutor(max_workers=max(1, min(MAP_MAX_WORKERS, len(items))))
+        try:
+            futures = []
+            for idx, item in enumerate(items):
+                # Reuse summaries that are stored or were started during extraction
+                if idx in prefetched and prefetched[idx][0] == item:
+                    futures.append(prefetched[idx][1])
+                else:
+                    futures.append(pool.submit(fn, idx, item))
+
+            part_of = {future: idx + 1 for idx, future in enumerate(futures)}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    future.result()
+                    yield MapProgress(f"✅ {label} {part_of[future]} OF {len(items)} ({done}/{len(items)} done)")
+                except llm.CircuitOpen:
+                    # The model is down: stop here so callers use their fallbacks instead of a partial context
+                    raise
+                except Exception as e:
+                    logger.warning(f"{label} {part_of[future]} failed: {e}")
+                    yield MapProgress(f"⚠️ SKIPPED {label} {part_of[future]} OF {len(items)} ({done}/{len(items)} done)")
+
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except:
+                    results.append(None)
+            yield results
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def condense(self, transcript, early_map=None, known=None, collect=None):
+        """
+        Recursive map-reduce: summarizes every chunk, then merges groups of REDUCE_FAN_IN
+        summaries level by level until the result fits FINAL_CONTEXT_TOKENS.
+        Yields MapProgress lines, then the final context string.
+
+        known maps chunk_hash -> stored summary and skips those chunks' LLM calls;
+        collect, if given, is filled with chunk_hash -> (chunk index, summary) for storage.
+        """
+        text_chunks = self.split_chunks(transcript)
+        if len(text_chunks) <= 1:
+            yield transcript
+            return
+
+        hashes = [chunk_hash(chunk) for chunk in text_chunks]
+        prefetched = dict(early_map.futures) if early_map else {}
+        for idx, h in enumerate(hashes):
+            if known and h in known:
+                prefetched[idx] = (text_chunks[idx], _done_future(known[h]))
+
+        # Step 1: Map every chunk, nothing past a fixed chunk count is dropped
+        summaries = []
+        for item in self._run_parallel(self.summarize_chunk, text_chunks, "SUMMARIZED PART", prefetched):
+            if isinstance(item, MapProgress):
+                yield item
+            else:
+                if collect is not None:
+                    collect.update({hashes[idx]: (idx, summary) for idx, summary in enumerate(item) if summary})
+                summaries = [summary for summary in item if summary]
+        if not summaries:
+            # Nothing to build on: let callers fall back instead of carrying on with an empty context
+            raise RuntimeError("no chunk summaries")
+
+        # Step 2: Tree-reduce, each level cuts the number of summaries by REDUCE_FAN_IN
+        level = 1
+        while len(summaries) > 1 and estimate_tokens("\n\n".join(summaries)) > FINAL_CONTEXT_TOKENS:
+            groups = [summaries[i:i + REDUCE_FAN_IN] for i in range(0, len(summaries), REDUCE_FAN_IN)]
+            yield MapProgress(f">>> MERGING {len(summaries)} SUMMARIES INTO {len(groups)} (LEVEL {level})")
+            for item in self._run_parallel(self.reduce_summaries, groups, f"MERGED GROUP (LEVEL {level})"):
+                if isinstance(item, MapProgress):
+                    yield item
+                else:
+                    # A failed merge keeps a trimmed copy of its group so every level still shrinks
+                    budget = FINAL_CONTEXT_TOKENS // len(groups)
+                    summaries = [merged if merged else clip_to_tokens("\n\n".join(group), budget)
+                                 for merged, group in zip(item, groups)]
+            level += 1
+
+        yield "\n\n".join(summaries)
+
+    def condense_text(self, transcript, known=None, collect=None):
+        """Non-streaming condense(): returns only the final context."""
+        context = transcript
+        for item in self.condense(transcript, known=known, collect=collect):
+            if not isinstance(item, MapProgress):
+                context = item
+        return context
+
+    def known_digest(self, transcript, known, max_tokens):
+        """
+        Builds a whole-lecture digest from stored chunk summaries without any LLM call.
+        Every chunk gets an equal share of max_tokens; returns None unless all chunks are known.
+        """
+        chunks = self.split_chunks(transcript or "")
+        if len(chunks) <= 1 or not known:
+            return None
+        hashes = [chunk_hash(chunk) for chunk in chunks]
+        if not all(h in known for h in hashes):
+            return None
+        return "\n\n".join(clip_to_tokens(known[h], max_tokens // len(hashes)) for h in hashes)
 
-    def get_study_notes(self, transcript):
+    def start_map(self):
+        """Returns an EarlyMap that can be fed text while a document is still being extracted."""
+        return EarlyMap(self)
+
+    def get_study_notes(self, transcript, early_map=None, progress=False, known=None, collect=None):
         if not transcript or len(transcript.strip()) < 50:
             yield "Content too brief...", "The provided content was too brief."
             return
 
-        # NEW: Process in chunks if transcript is long
-        chunk_size = 15000
-        overlap = 1000
-        text_chunks = []
-        for i in range(0, len(transcript), chunk_size - overlap):
-            text_chunks.append(transcript[i:i + chunk_size])
-
-        # Step 1: Create a combined map if there are multiple chunks
-        if len(text_chunks) > 1:
-            intermediate_summaries = []
-            for idx, chunk in enumerate(text_chunks[:10]): # Process up to 10 chunks (~150k chars)
-                prompt = f"Summarize this part of the lecture in detail for notes. Part {idx+1}:\n\n{chunk}"
-                try:
-                    res = self.client.chat.completions.create(model="llama-3.1-8b-instant", messages=[{"role": "user", "content": prompt}])
-                    intermediate_summaries.append(res.choices[0].message.content)
-                except: continue
-            final_context = "\n\n".join(intermediate_summaries)
-        else:
-            final_context = transcript
-
-        # Step 2: Final Academic Synthesis
+        # NEW: Condense long transcripts with a recursive map-reduce
+        final_context = transcript
+        for item in self.condense(transcript, early_map, known, collect):
+            if isinstance(item, MapProgress):
+                if progress:
+                    yield item, None
+            else:
+                final_context = item
+
+        # Final Academic Synthesis
         system_prompt = """
         You are a world-class academic scribe. Convert the provided transcript into Professional Lecture Notes.
         Use the Cornell Note-Taking framework:
@@ -56,22 +199,53 @@ class StudyAI:
         
         full_response = []
         try:
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
+            completion = llm.stream(
+                [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": f"Create Professional Study Notes from this context:\n\n{final_context}"}
                 ],
-                temperature=0.4,
-                stream=True
+                model=self.model,
+                temperature=0.4
             )
-            for chunk in completion:
-                content = chunk.choices[0].delta.content
-                if content:
-                    full_response.append(content)
-                    yield content, None
+            for content in completion:
+                full_response.append(content)
+                yield content, None
             yield None, "".join(full_response)
         except Exception as e:
             yield None, f"Error: {str(e)}"
 
+class EarlyMap:
+    """
+    Starts map-phase summaries while a document is still streaming in.
+    A chunk's cut only depends on the text up to its own end, so it can be summarized
+    as soon as that much text has arrived instead of after the last page.
+    """
+    def __init__(self, assistant):
+        self.assistant = assistant
+        self.parts = []
+        self.length = 0
+        self.next_start = 0
+        self.futures = {} # chunk index -> (chunk text, Future)
+        self.pool = ThreadPoolExecutor(max_workers=2)
+
+    def feed(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+        if self.length <= self.next_start + MAP_CHUNK_TOKENS * CHARS_PER_TOKEN:
+            return
+        full_text = "".join(self.parts)
+        self.parts = [full_text]
+        while True:
+            bounds = chunk_bounds(full_text, self.next_start, MAP_CHUNK_TOKENS, MAP_OVERLAP_TOKENS, final=False)
+            if bounds is None:
+                break
+            end, next_start = bounds
+            idx = len(self.futures)
+            chunk = full_text[self.next_start:end]
+            self.futures[idx] = (chunk, self.pool.submit(self.assistant.summarize_chunk, idx, chunk))
+            self.next_start = next_start
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
 ai_assistant = StudyAI()
@@ -1,113 +1,393 @@
-import base64
+import hashlib
 import io
+import json
+import mmap
 import os
-from groq import Groq
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pypdf import PdfReader
 import pypdfium2 as pdfium
 import docx
 import pptx
+from utils import llm
+from utils.cache import DiskCache
+from utils.image_prep import prepare_image, IMAGE_MAX_BYTES
 
-client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+# How many vision requests may be in flight at once while OCR-ing a scanned PDF
+OCR_MAX_WORKERS = int(os.environ.get("OCR_MAX_WORKERS", 4))
+OCR_PROMPT = "Transcribe the text in this lecture slide/document perfectly."
+# Specialized prompt for student notes and handwriting
+NOTE_OCR_PROMPT = ("Transcribe this student note or textbook snapshot perfectly. "
+                   "If it is handwritten, read it carefully and preserve the logical structure.")
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.heic', '.heif')
+# Pages whose text layer has fewer visible characters than this are treated as scans
+OCR_MIN_PAGE_CHARS = int(os.environ.get("OCR_MIN_PAGE_CHARS", 50))
+# Optional safety cap on vision calls per document (0 = no cap)
+OCR_MAX_PAGES = int(os.environ.get("OCR_MAX_PAGES", 0))
+# Pages packed into one multi-image vision request (the API accepts up to 5 images; 1 disables batching)
+OCR_BATCH_SIZE = max(1, min(5, int(os.environ.get("OCR_BATCH_SIZE", 3))))
+
+# Path inputs at least this large are extracted in low-memory mode automatically
+LOW_MEMORY_FILE_BYTES = int(os.environ.get("LOW_MEMORY_FILE_MB", 25)) * 1024 * 1024
+
+# Bump whenever extraction output changes so stale cache entries stop matching
+EXTRACTOR_VERSION = "6"
+# Extracted text is cached by upload hash so re-uploads skip parsing and paid OCR
+extraction_cache = DiskCache("extraction", int(os.environ.get("EXTRACTION_CACHE_MAX_MB", 256)) * 1024 * 1024)
+
+VISION_ERROR_MARKER = "[Vision Error"
+PAGE_DELIMITER_RE = re.compile(r"^\s*=== PAGE (\d+) ===\s*$", re.MULTILINE)
+
+# pdfium is not thread-safe, so page rendering is serialized across workers
+_pdfium_lock = threading.Lock()
+# In low-memory mode a page is rendered and encoded before the next render may start
+_low_memory_slot = threading.Lock()
 
 def call_groq_vision(base64_image, prompt_text):
     try:
-        response = client.chat.completions.create(
-            messages=[{
+        text = llm.complete(
+            [{
                 "role": "user",
                 "content": [
                     {"type": "text", "text": prompt_text},
                     {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
                 ]
             }],
-            model="llama-3.2-11b-vision-preview",
+            model=llm.VISION_MODEL, kind="vision", cache=True,
         )
-        return response.choices[0].message.content + "\n"
+        return text + "\n"
     except Exception as e:
         return f"\n[Vision Error: {str(e)}]\n"
 
-def extract_text_from_file(file_obj_or_path):
+def call_groq_vision_batch(base64_images, prompt_text):
+    """
+    Sends several images in one vision request and splits the reply back per image.
+    Returns one entry per image, None where the reply had no usable section for it.
+    """
+    content = [{"type": "text", "text": (
+        f"{prompt_text}\nYou are given {len(base64_images)} page images in order. "
+        "For every page, first write a line '=== PAGE n ===' (n = the page number below), "
+        "then that page's text. Do not skip or merge pages."
+    )}]
+    for n, base64_image in enumerate(base64_images, 1):
+        content.append({"type": "text", "text": f"Page {n}:"})
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}})
+    try:
+        text = llm.complete([{"role": "user", "content": content}], model=llm.VISION_MODEL, kind="vision", cache=True)
+        return split_batch_response(text, len(base64_images))
+    except Exception as e:
+        print(f"Batched vision call failed, retrying pages one by one: {e}")
+        return [None] * len(base64_images)
+
+def split_batch_response(text, count):
+    parts = PAGE_DELIMITER_RE.split(text or "")
+    pages = [None] * count
+    # re.split alternates [preamble, number, body, number, body, ...]
+    for number, body in zip(parts[1::2], parts[2::2]):
+        k = int(number) - 1
+        if 0 <= k < count and pages[k] is None and body.strip():
+            pages[k] = body.strip() + "\n"
+    return pages
+
+def ocr_images(base64_images, prompt_text):
+    """OCRs images in one batched request, falling back to single-image calls for pages the reply missed."""
+    if len(base64_images) == 1:
+        return [call_groq_vision(base64_images[0], prompt_text)]
+    texts = call_groq_vision_batch(base64_images, prompt_text)
+    return [text if text is not None else call_groq_vision(image, prompt_text)
+            for image, text in zip(base64_images, texts)]
+
+def is_sparse_page(page_text):
+    """True when a page's text layer is too thin to trust (scanned or photographed pages)."""
+    return sum(1 for ch in page_text or "" if not ch.isspace()) < OCR_MIN_PAGE_CHARS
+
+def page_has_images(page):
+    """True when a pypdf page draws a raster image, directly or inside a form XObject."""
+    try:
+        return _resources_have_images(page.get("/Resources"))
+    except Exception:
+        # Unreadable resources: let the page be OCR'd rather than risk losing a scan
+        return True
+
+def _resources_have_images(resources, depth=0):
+    if resources is None or depth > 4:
+        return False
+    xobjects = resources.get_object().get("/XObject")
+    if xobjects is None:
+        return False
+    for ref in xobjects.get_object().values():
+        xobject = ref.get_object()
+        if xobject.get("/Subtype") == "/Image":
+            return True
+        if xobject.get("/Subtype") == "/Form" and _resources_have_images(xobject.get("/Resources"), depth + 1):
+            return True
+    return False
+
+def render_page_base64(pdf, index, max_bytes=None, low_memory=False):
+    """Renders one PDF page to a base64 JPEG ready for the vision model, freeing the bitmap right after."""
+    with _low_memory_slot if low_memory else nullcontext():
+        with _pdfium_lock:
+            page = pdf[index]
+            bitmap = page.render(scale=2)
+            pil_image = bitmap.to_pil()
+        try:
+            base64_image, _ = prepare_image(pil_image, max_bytes=max_bytes)
+        finally:
+            with _pdfium_lock:
+                pil_image.close()
+                bitmap.close()
+                page.close()
+    return base64_image
+
+def ocr_pdf_batch(pdf, indexes, low_memory=False):
+    # The request byte budget is shared by every page packed into it
+    max_bytes = IMAGE_MAX_BYTES // len(indexes)
+    return ocr_images([render_page_base64(pdf, i, max_bytes, low_memory) for i in indexes], OCR_PROMPT)
+
+def is_image_file(filename):
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+def extract_images(files):
+    """
+    OCRs several uploaded images (Flask file objects or local paths) with up to
+    OCR_BATCH_SIZE of them packed into one vision request. Returns one text per image,
+    in order. Images already in the extraction cache cost no vision call.
+    """
+    texts = [None] * len(files)
+    todo = []
+    for k, file_obj_or_path in enumerate(files):
+        if isinstance(file_obj_or_path, str):
+            filename = file_obj_or_path.lower()
+            with open(file_obj_or_path, 'rb') as f:
+                cache_key, image_bytes = extraction_cache_key(f, filename), f.read()
+        else:
+            filename = file_obj_or_path.filename.lower()
+            cache_key = extraction_cache_key(file_obj_or_path, filename)
+            image_bytes = file_obj_or_path.read()
+        try:
+            cached = extraction_cache.get(cache_key)
+        except Exception as e:
+            print(f"Extraction cache unavailable: {e}")
+            cached = None
+        if cached is not None:
+            texts[k] = "".join(json.loads(cached))
+        else:
+            todo.append((k, cache_key, image_bytes))
+
+    for start in range(0, len(todo), OCR_BATCH_SIZE):
+        batch = todo[start:start + OCR_BATCH_SIZE]
+        # The request byte budget is shared by every image packed into it
+        max_bytes = IMAGE_MAX_BYTES // len(batch)
+        base64_images = [prepare_image(image_bytes, max_bytes=max_bytes)[0] for _, _, image_bytes in batch]
+        for (k, cache_key, _), text in zip(batch, ocr_images(base64_images, NOTE_OCR_PROMPT)):
+            texts[k] = text
+            if VISION_ERROR_MARKER not in text:
+                try:
+                    extraction_cache.set(cache_key, json.dumps([text]))
+                except Exception as e:
+                    print(f"Extraction cache unavailable: {e}")
+    return texts
+
+def file_sha256(f):
+    """Hashes an open binary file in blocks and rewinds it."""
+    f.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: f.read(1024 * 1024), b""):
+        digest.update(block)
+    f.seek(0)
+    return digest.hexdigest()
+
+def extraction_cache_key(f, filename):
+    ext = filename.rsplit('.', 1)[-1]
+    return f"{file_sha256(f)}:{ext}:v{EXTRACTOR_VERSION}"
+
+def extract_text_from_file(file_obj_or_path, low_memory=None):
     """
     Unified text extraction for PDF, DOCX, PPTX, and Images.
     Supports both Flask file objects and local file paths.
+    Results are cached by content hash, so the same upload is only parsed once.
     """
+    return "".join(text for _, text in iter_text_from_file(file_obj_or_path, low_memory))
+
+def iter_text_from_file(file_obj_or_path, low_memory=None):
+    """
+    Streaming variant of extract_text_from_file.
+    Yields (page_no, text) as soon as each page is ready, in page order.
+    PDFs yield one item per page, every other format yields a single item.
+
+    low_memory memory-maps PDFs given by path and renders one page at a time;
+    None turns it on for paths of at least LOW_MEMORY_FILE_BYTES.
+    """
+    path = None
     if isinstance(file_obj_or_path, str):
         # It's a path
+        path = file_obj_or_path
         filename = file_obj_or_path.lower()
         f = open(file_obj_or_path, 'rb')
     else:
         # It's a file object (e.g. from Flask request)
         filename = file_obj_or_path.filename.lower()
         f = file_obj_or_path
+    if low_memory is None:
+        low_memory = path is not None and os.path.getsize(path) >= LOW_MEMORY_FILE_BYTES
 
-    extracted_text = ""
-    
     try:
-        if filename.endswith('.pdf'):
-            f.seek(0)
-            reader = PdfReader(f)
-            for page in reader.pages:
-                extracted_text += page.extract_text() or ""
-            
-            # If standard text extraction fails or is very sparse, use OCR
-            if len(extracted_text.strip()) < 50:
-                f.seek(0)
-                pdf = pdfium.PdfDocument(f)
-                # Handle up to 30 pages for deep scanning
-                for i in range(min(30, len(pdf))):
-                    page = pdf[i]
-                    bitmap = page.render(scale=2)
-                    pil_image = bitmap.to_pil()
-                    img_byte_arr = io.BytesIO()
-                    pil_image.save(img_byte_arr, format='JPEG')
-                    base64_image = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
-                    # OCR with Groq Vision
-                    extracted_text += call_groq_vision(base64_image, "Transcribe the text in this lecture slide/document perfectly.")
-                pdf.close()
-
-        elif filename.endswith(('.png', '.jpg', '.jpeg', '.webp', '.heic', '.heif')):
-            f.seek(0)
-            image_bytes = f.read()
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
-            # Specialized prompt for student notes and handwriting
-            extracted_text = call_groq_vision(base64_image, "Transcribe this student note or textbook snapshot perfectly. If it is handwritten, read it carefully and preserve the logical structure.")
-
-        elif filename.endswith('.docx'):
-            f.seek(0)
-            doc = docx.Document(f)
-            full_text = []
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    full_text.append(para.text)
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            full_text.append(cell.text)
-            extracted_text = "\n".join(full_text)
-            if not extracted_text.strip():
-                extracted_text = "[System Warning: Word document appeared to be empty.]"
-
-        elif filename.endswith(('.pptx', '.ppt')):
-            f.seek(0)
-            prs = pptx.Presentation(f)
-            full_text = []
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        full_text.append(shape.text)
-            extracted_text = "\n".join(full_text)
-            if not extracted_text.strip():
-                extracted_text = "[System Warning: PowerPoint appeared to be empty.]"
-
-        elif filename.endswith('.txt'):
-            f.seek(0)
-            extracted_text = f.read().decode('utf-8', errors='ignore')
+        cache_key = None
+        cached = None
+        try:
+            cache_key = extraction_cache_key(f, filename)
+            cached = extraction_cache.get(cache_key)
+        except Exception as e:
+            print(f"Extraction cache unavailable: {e}")
 
-    except Exception as e:
-        print(f"Extraction Error for {filename}: {e}")
-        extracted_text = f"\n[System Error reading {filename}: {str(e)}]\n"
+        if cached is not None:
+            for page_no, text in enumerate(json.loads(cached), 1):
+                yield page_no, text
+            return
+
+        pages = []
+        for page_no, text in _iter_pages_uncached(f, filename, path, low_memory):
+            pages.append(text)
+            yield page_no, text
+
+        # Never cache partial results from failed reads or vision calls
+        extracted_text = "".join(pages)
+        if cache_key and "[System Error" not in extracted_text and VISION_ERROR_MARKER not in extracted_text:
+            try:
+                extraction_cache.set(cache_key, json.dumps(pages))
+            except Exception as e:
+                print(f"Extraction cache unavailable: {e}")
     finally:
         if isinstance(file_obj_or_path, str):
             f.close()
-            
+
+def _iter_pages_uncached(f, filename, path=None, low_memory=False):
+    page_no = 0
+    try:
+        if filename.endswith('.pdf'):
+            for page_no, text in _iter_pdf_pages(f, path, low_memory):
+                yield page_no, text
+        else:
+            yield 1, _extract_document(f, filename)
+    except Exception as e:
+        print(f"Extraction Error for {filename}: {e}")
+        yield page_no + 1, f"\n[System Error reading {filename}: {str(e)}]\n"
+
+def _iter_pdf_pages(f, path=None, low_memory=False):
+    low_memory = low_memory and path is not None
+    data = None
+    if low_memory:
+        # Memory-map the file so only the parts pypdf touches are paged in
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    elif path is not None:
+        f.seek(0)
+        source = f
+    else:
+        # pypdf and pdfium (in the OCR threads) read at the same time, so they can't share the upload's handle
+        f.seek(0)
+        data = f.read()
+        source = io.BytesIO(data)
+
+    reader = pdf = None
+    pool = ThreadPoolExecutor(max_workers=max(1, OCR_MAX_WORKERS))
+    pending = deque()  # (page index, text) in page order, waiting to be handed out
+    batch = []         # sparse pages not yet sent to OCR
+    ocr = {}           # page index -> (future, position in its batch)
+
+    def send_batch():
+        future = pool.submit(partial(ocr_pdf_batch, low_memory=low_memory), pdf, list(batch))
+        for position, i in enumerate(batch):
+            ocr[i] = (future, position)
+        batch.clear()
+
+    def ready_pages(wait):
+        # Pages go out in order; a page still waiting for OCR holds back the ones after it
+        while pending:
+            i, text = pending[0]
+            if i in ocr:
+                future, position = ocr[i]
+                if not wait and not future.done():
+                    return
+                ocr_text = future.result()[position]
+                # Keep whatever text layer the page had if the vision call failed
+                if not text.strip() or VISION_ERROR_MARKER not in ocr_text:
+                    text = ocr_text
+            elif i in batch:
+                return
+            pending.popleft()
+            yield i + 1, text
+
+    try:
+        reader = PdfReader(source)
+        ocr_pages = 0
+        for i, page in enumerate(reader.pages):
+            text = page.extract_text() or ""
+            # Only pages with a sparse text layer and an image go to OCR; title slides keep their text
+            if is_sparse_page(text) and page_has_images(page) and (not OCR_MAX_PAGES or ocr_pages < OCR_MAX_PAGES):
+                ocr_pages += 1
+                if pdf is None:
+                    # pdfium reads straight from disk instead of holding the upload in memory
+                    pdf = pdfium.PdfDocument(path if path is not None else data)
+                batch.append(i)
+                # Sparse pages are packed into multi-image batches and several batches stay in flight
+                if len(batch) == OCR_BATCH_SIZE:
+                    send_batch()
+            pending.append((i, text))
+            yield from ready_pages(wait=False)
+        if batch:
+            send_batch()
+        yield from ready_pages(wait=True)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if pdf is not None:
+            pdf.close()
+        del reader
+        if low_memory:
+            source.close()
+
+def _extract_document(f, filename):
+    extracted_text = ""
+
+    if is_image_file(filename):
+        f.seek(0)
+        image_bytes = f.read()
+        base64_image, _ = prepare_image(image_bytes)
+        extracted_text = call_groq_vision(base64_image, NOTE_OCR_PROMPT)
+
+    elif filename.endswith('.docx'):
+        f.seek(0)
+        doc = docx.Document(f)
+        full_text = []
+        for para in doc.paragraphs:
+            if para.text.strip():
+                full_text.append(para.text)
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    if cell.text.strip():
+                        full_text.append(cell.text)
+        extracted_text = "\n".join(full_text)
+        if not extracted_text.strip():
+            extracted_text = "[System Warning: Word document appeared to be empty.]"
+
+    elif filename.endswith(('.pptx', '.ppt')):
+        f.seek(0)
+        prs = pptx.Presentation(f)
+        full_text = []
+        for slide in prs.slides:
+            for shape in slide.shapes:
+                if hasattr(shape, "text"):
+                    full_text.append(shape.text)
+        extracted_text = "\n".join(full_text)
+        if not extracted_text.strip():
+            extracted_text = "[System Warning: PowerPoint appeared to be empty.]"
+
+    elif filename.endswith('.txt'):
+        f.seek(0)
+        extracted_text = f.read().decode('utf-8', errors='ignore')
+
     return extracted_text
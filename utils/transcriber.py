@@ -5,16 +5,15 @@ import queue
 import time
 import subprocess
 import json
-from groq import Groq
+from concurrent.futures import ThreadPoolExecutor
+from utils import llm
 
 # Full paths for reliability on Windows
 FFMPEG_PATH = r"C:\Users\Prince Code\AppData\Local\Microsoft\WinGet\Packages\Gyan.FFmpeg_Microsoft.Winget.Source_8wekyb3d8bbwe\ffmpeg-8.1-full_build\bin\ffmpeg.exe"
 FFPROBE_PATH = r"C:\Users\Prince Code\AppData\Local\Microsoft\WinGet\Packages\Gyan.FFmpeg_Microsoft.Winget.Source_8wekyb3d8bbwe\ffmpeg-8.1-full_build\bin\ffprobe.exe"
 
-client = Groq(
-    api_key=os.environ.get("GROQ_API_KEY"),
-    timeout=180.0 # Increased timeout for slow uploads
-)
+# Whisper uploads in flight at once when a long lecture is split into parts (1 = one at a time)
+TRANSCRIBE_PARALLEL = max(1, int(os.environ.get("TRANSCRIBE_PARALLEL", 3)))
 
 def get_audio_duration(file_path):
     """Uses ffprobe with absolute path."""
@@ -28,6 +27,38 @@ def get_audio_duration(file_path):
         print(f"Duration Error: {e}")
         return None
 
+def split_part(ffmpeg_exe, abs_input_path, start_time, chunk_size, chunk_filename):
+    """Cuts one part of the lecture into its own mp3."""
+    # Use High-bitrate MP3 for maximum Groq stability
+    # Explicitly force output format to mp3 to avoid any ambiguity
+    split_cmd = [
+        ffmpeg_exe, '-y', '-ss', str(start_time), '-t', str(chunk_size),
+        '-i', abs_input_path, '-ac', '1', '-ar', '16000', '-b:a', '192k',
+        '-f', 'mp3', chunk_filename
+    ]
+    subprocess.run(split_cmd, check=True, capture_output=True)
+
+def transcribe_part(split, chunk_filename, start_time):
+    """Waits for a part's split, uploads it and returns its timestamped lines (None if the split came out empty)."""
+    try:
+        split.result()
+        # Verify file exists and has data
+        if not os.path.exists(chunk_filename) or os.path.getsize(chunk_filename) < 1000:
+            return None
+
+        # Rate limits (429) are queued and retried by the shared LLM scheduler
+        with open(chunk_filename, "rb") as f:
+            transcription = llm.transcribe((os.path.basename(chunk_filename), f), response_format="verbose_json")
+
+        lines = []
+        for seg in getattr(transcription, 'segments', None) or []:
+            text, seg_start = getattr(seg, 'text', '').strip(), getattr(seg, 'start', 0) + start_time
+            if text:
+                lines.append(f"[{int(seg_start // 60):02}:{int(seg_start % 60):02}] {text}")
+        return lines
+    finally:
+        if os.path.exists(chunk_filename): os.remove(chunk_filename)
+
 def transcribe_audio_stream(file_path):
     gc.collect()
     abs_input_path = os.path.abspath(file_path)
@@ -41,9 +72,8 @@ def transcribe_audio_stream(file_path):
         yield f">>> Uploading {file_size_mb:.1f}MB to AI Professor...", None
         try:
             with open(abs_input_path, "rb") as f:
-                transcription = client.audio.transcriptions.create(
-                    file=(os.path.basename(abs_input_path), f), 
-                    model="whisper-large-v3-turbo", 
+                transcription = llm.transcribe(
+                    (os.path.basename(abs_input_path), f), 
                     response_format="verbose_json"
                 )
             
@@ -73,61 +103,55 @@ def transcribe_audio_stream(file_path):
     yield f">>> DETECTED {int(total_duration//60)} MINUTE LECTURE. PROCESSING {num_chunks} PARTS...", None
 
     ffmpeg_exe = FFMPEG_PATH if os.path.exists(FFMPEG_PATH) else 'ffmpeg'
+    stamp = int(time.time())
 
-    for i in range(num_chunks):
-        progress = int(((i) / num_chunks) * 100)
-        start_time = i * chunk_size
-        chunk_filename = os.path.abspath(f"chunk_{i}_{int(time.time())}.mp3")
-        yield f"[{progress}%] PROCESSING PART {i+1} of {num_chunks}...", None
+    # Pipeline: one ffmpeg split runs ahead while up to TRANSCRIBE_PARALLEL parts upload;
+    # results are still read back in part order so lines come out in timestamp order
+    splitter = ThreadPoolExecutor(max_workers=1)
+    uploader = ThreadPoolExecutor(max_workers=TRANSCRIBE_PARALLEL)
+    parts = {}
 
-        try:
-            # Use High-bitrate MP3 for maximum Groq stability
-            # Explicitly force output format to mp3 to avoid any ambiguity
-            split_cmd = [
-                ffmpeg_exe, '-y', '-ss', str(start_time), '-t', str(chunk_size),
-                '-i', abs_input_path, '-ac', '1', '-ar', '16000', '-b:a', '192k',
-                '-f', 'mp3', chunk_filename
-            ]
-            subprocess.run(split_cmd, check=True, capture_output=True)
-            
-            # Verify file exists and has data
-            time.sleep(1.0) # Sync wait
+    def submit(i):
+        chunk_filename = os.path.abspath(f"chunk_{i}_{stamp}.mp3")
+        split = splitter.submit(split_part, ffmpeg_exe, abs_input_path, i * chunk_size, chunk_size, chunk_filename)
+        parts[i] = (uploader.submit(transcribe_part, split, chunk_filename, i * chunk_size), chunk_filename)
 
-            if not os.path.exists(chunk_filename) or os.path.getsize(chunk_filename) < 1000:
-                yield f"⚠️ Skipping part {i+1}: Zero-byte file produced.", None
-                continue
+    try:
+        for i in range(min(num_chunks, TRANSCRIBE_PARALLEL + 1)):
+            submit(i)
 
-            # RETRY for Rate Limits (429)
-            transcription = None
-            for attempt in range(3):
-                try:
-                    with open(chunk_filename, "rb") as f:
-                        transcription = client.audio.transcriptions.create(file=(os.path.basename(chunk_filename), f), model="whisper-large-v3-turbo", response_format="verbose_json")
-                    break
-                except Exception as api_e:
-                    if "429" in str(api_e) and attempt < 2:
-                        wait = 30 + (attempt * 30)
-                        yield f"⏳ Rate limit! Waiting {wait}s...", None
-                        time.sleep(wait)
-                    else: raise api_e
-
-            if transcription:
-                count = 0
-                for seg in getattr(transcription, 'segments', []):
-                    text, seg_start = getattr(seg, 'text', '').strip(), getattr(seg, 'start', 0) + start_time
-                    if text:
-                        line = f"[{int(seg_start // 60):02}:{int(seg_start % 60):02}] {text}"
-                        yield line, None
-                        full_transcript.append(line)
-                        count += 1
-                if count > 0:
-                    yield f"✅ Part {i+1}: Captured {count} lines.", None
-                else:
-                    yield f"ℹ️ Part {i+1}: No speech detected.", None
+        for i in range(num_chunks):
+            progress = int(((i) / num_chunks) * 100)
+            yield f"[{progress}%] PROCESSING PART {i+1} of {num_chunks}...", None
+            if i + TRANSCRIBE_PARALLEL + 1 < num_chunks:
+                submit(i + TRANSCRIBE_PARALLEL + 1)
 
-        except Exception as e:
-            yield f"⚠️ Error in part {i+1}: {str(e)}", None
-        finally:
+            try:
+                lines = parts.pop(i)[0].result()
+            except llm.CircuitOpen as e:
+                # The transcription service is down: keep what we have instead of failing every remaining part
+                yield f"❌ Stopping at part {i+1}: {str(e)}", None
+                break
+            except Exception as e:
+                yield f"⚠️ Error in part {i+1}: {str(e)}", None
+                continue
+
+            if lines is None:
+                yield f"⚠️ Skipping part {i+1}: Zero-byte file produced.", None
+                continue
+            for line in lines:
+                yield line, None
+                full_transcript.append(line)
+            if lines:
+                yield f"✅ Part {i+1}: Captured {len(lines)} lines.", None
+            else:
+                yield f"ℹ️ Part {i+1}: No speech detected.", None
+    finally:
+        # Stopped early (error or client gone): drop queued parts and any split files nobody will upload
+        leftovers = [chunk_filename for future, chunk_filename in parts.values() if future.cancel()]
+        splitter.shutdown(wait=True, cancel_futures=True)
+        uploader.shutdown(wait=False, cancel_futures=True)
+        for chunk_filename in leftovers:
             if os.path.exists(chunk_filename): os.remove(chunk_filename)
 
     yield None, "\n".join(full_transcript)